@@ -0,0 +1,66 @@
+"""
+A simple benchmark running the same spawn/status/teardown workload
+against the available backends
+
+    python benchmark.py memory
+    python benchmark.py containers unix:///var/run/docker.sock
+    python benchmark.py swarm
+
+The swarm benchmark runs on the swarm the local daemon manages.
+"""
+from mettaton import Mettaton, MettatonSwarm, MemoryBackend, ContainerBackend
+from mettaton.core import Orchestrator
+import logging
+import sys
+import time
+
+def workload(manager, count, image):
+    """Spawn `count` servers in one batch, query them, and tear them down"""
+    timings = {}
+    now = time.time()
+    results = manager.start_servers([{
+        "image": image,
+        "name": "bench-{:04d}".format(i)
+        } for i in range(count)])
+    timings["spawn"] = time.time() - now
+    idents = [result[1] for result in results if not isinstance(result, Exception)]
+
+    now = time.time()
+    for ident in idents:
+        manager.get_status(ident)
+    timings["status"] = time.time() - now
+
+    now = time.time()
+    for ident in idents:
+        manager.shutdown_server(ident)
+    timings["teardown"] = time.time() - now
+    return timings
+
+def main():
+    logging.getLogger("mettaton").setLevel(logging.WARNING)
+    backend_name = sys.argv[1] if len(sys.argv) > 1 else "memory"
+    endpoints = sys.argv[2:] or ["host-1", "host-2"]
+    count = 50
+
+    if backend_name == "memory":
+        # Simulate a few milliseconds of daemon round-trip
+        backend = MemoryBackend(latency=0.005)
+    elif backend_name == "containers":
+        backend = ContainerBackend()
+    elif backend_name != "swarm":
+        raise SystemExit("Unknown backend {}".format(backend_name))
+
+    if backend_name == "swarm":
+        manager = MettatonSwarm(storage_path="/tmp/mettaton-bench.state")
+        manager.connect()
+        manager.regain_cluster()
+    else:
+        manager = Mettaton(endpoints, storage_path="/tmp/mettaton-bench.state", backend=backend)
+    timings = workload(manager, count, "alpine:latest")
+    # Only let go of the swarm, never leave it
+    Orchestrator.shutdown(manager)
+    for step, duration in timings.items():
+        print("{:10} {:8.3f}s ({:.2f} ms per server)".format(step, duration, 1000 * duration / count))
+
+if __name__ == "__main__":
+    main()
@@ -4,5 +4,7 @@ __version__ = "0.0.0"
 from .logger import init_logger
 init_logger()
 
-# Expose the class
-from .mettaton import Mettaton
\ No newline at end of file
+# Expose the classes
+from .mettaton import Mettaton
+from .swarm import MettatonSwarm
+from .backends import Backend, ContainerBackend, SwarmBackend, MemoryBackend
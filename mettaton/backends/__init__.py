@@ -0,0 +1,10 @@
+"""
+Backends run game servers on behalf of the orchestrator core.
+Every backend implements the `Backend` interface.
+"""
+
+from .base import Backend
+from .coalescer import Coalescer
+from .containers import ContainerBackend
+from .swarm import SwarmBackend
+from .memory import MemoryBackend
@@ -0,0 +1,108 @@
+"""Backend interface"""
+
+from ..errors import NoSuchInstance
+
+class Backend:
+    """
+    A backend knows how to reach a set of endpoints and run game server
+    instances on them. The orchestrator core handles scheduling, state
+    and health on top of it.
+
+    Every method raising because of the underlying engine must raise one
+    of the errors of `mettaton.errors` (or a `RuntimeError`), never an
+    engine-specific exception. Implementations must be thread-safe.
+    """
+    # Short name of the backend, used in logs
+    name = "base"
+
+    def connect(self, endpoint: str):
+        """Open a connection to `endpoint`"""
+        raise NotImplementedError
+
+    def disconnect(self, endpoint: str):
+        """Close the connection to `endpoint`, leaving its instances alone"""
+        raise NotImplementedError
+
+    def endpoints(self) -> list:
+        """Return the list of endpoints we are connected to"""
+        raise NotImplementedError
+
+    def ping(self, endpoint: str) -> bool:
+        """Cheap liveness probe of `endpoint`. May raise or hang if it is dead."""
+        raise NotImplementedError
+
+    def spawn(self, endpoint: str, spec: dict, **options) -> str:
+        """
+        Create and start an instance on `endpoint` from `spec`, a dictionary
+        with the keys `image`, `name`, `environment` and `port_config`.
+        `options` are backend-specific and not persisted.
+        Returns the identifier of the instance.
+        """
+        raise NotImplementedError
+
+    def stop(self, endpoint: str, ident: str, timeout: float = None):
+        """
+        Stop and remove the instance `ident` on `endpoint`, giving it `timeout`
+        seconds to exit before killing it (the engine default if `None`)
+        """
+        raise NotImplementedError
+
+    def status(self, endpoint: str, ident: str) -> str:
+        """Return the run status ("running", "exited", ...) of instance `ident`"""
+        raise NotImplementedError
+
+    def health(self, endpoint: str, idents: list) -> dict:
+        """
+        Return the health of several instances of `endpoint` as a dictionary
+        of identifiers and health status. Instances that no longer exist are
+        reported as "NOT_FOUND", those that could not be checked are left out.
+        The default implementation asks for the status of every instance.
+        """
+        result = {}
+        for ident in idents:
+            try:
+                result[ident] = self.status(endpoint, ident)
+            except NoSuchInstance:
+                result[ident] = "NOT_FOUND"
+            except RuntimeError:
+                continue
+        return result
+
+    def published_ports(self, endpoint: str) -> set:
+        """
+        Return the host ports published on `endpoint` by every instance
+        running there, ours or not, as a set of `(port, protocol)`.
+        The default implementation knows of none.
+        """
+        return set()
+
+    def activity(self, endpoint: str, idents: list, since: float) -> dict:
+        """
+        Return cheap activity counters of several instances of `endpoint` as a
+        dictionary of identifiers and `(network_bytes, log_lines)`, where
+        `network_bytes` is the total received and sent so far, and `log_lines`
+        the number of lines logged since the `since` timestamp. Instances that
+        could not be checked are left out.
+        The default implementation knows of none, so nothing ever looks idle.
+        """
+        return {}
+
+    def checkpoint(self, endpoint: str, ident: str, repository: str, tag: str = None) -> str:
+        """
+        Commit the current state of instance `ident` to an image of `repository`
+        tagged `tag`. Returns the identifier of the image.
+        """
+        raise NotImplementedError
+
+    def call_stats(self) -> dict:
+        """
+        Return the counters of the read calls made to the engine: "requests"
+        asked for, "calls" actually made, "hits" served by a call in flight
+        for someone else, and "coalesced" calls shared that way.
+        The default implementation has none.
+        """
+        return {}
+
+    def logs(self, endpoint: str, ident: str, **kwargs):
+        """Return the logs of instance `ident`, see `docker.models.containers.Container.logs`"""
+        raise NotImplementedError
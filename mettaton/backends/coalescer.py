@@ -0,0 +1,72 @@
+"""
+Request coalescing
+Lets concurrent identical read calls to a daemon share a single request
+"""
+
+from threading import Lock
+from concurrent.futures import Future
+
+class Coalescer:
+    """
+    Runs read calls on behalf of several threads. While a call is in flight,
+    identical calls (same key) wait for it and share its result, or its
+    exception, instead of reaching the daemon again. Nothing is cached once
+    the call returns.
+
+    Shared results are the very same objects for every caller, which must
+    treat them as read-only. Mutating calls must never go through here.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        # Future of every call in flight, by key
+        self.in_flight = {}
+        # Read calls requested
+        self.requests = 0
+        # Calls actually made
+        self.calls = 0
+        # Requests served by a call made for someone else
+        self.hits = 0
+        # Calls whose result was shared with at least one other request
+        self.coalesced = 0
+        self.shared = set()
+
+    def call(self, key: tuple, function, *args, **kwargs):
+        """
+        Return the result of `function(*args, **kwargs)`, joining the call in
+        flight for `key` if there is one. `key` must identify the endpoint,
+        the operation and all of its arguments.
+        """
+        with self.lock:
+            self.requests += 1
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.calls += 1
+            else:
+                self.hits += 1
+                if not future in self.shared:
+                    self.shared.add(future)
+                    self.coalesced += 1
+
+        if leader:
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as error:
+                future.set_exception(error)
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+                    self.shared.discard(future)
+        return future.result()
+
+    def stats(self) -> dict:
+        """Return the counters of the coalescer"""
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "calls": self.calls,
+                "hits": self.hits,
+                "coalesced": self.coalesced
+            }
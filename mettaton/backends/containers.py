@@ -0,0 +1,218 @@
+"""
+Direct containers backend
+Runs every instance as a plain container on one of several Docker daemons
+"""
+
+import docker   # engine
+import math     # Grace periods in whole seconds
+import logging  # logging library
+# Errors from docker's library
+from docker.errors import DockerException
+from docker.errors import ImageNotFound as DockerImageNotFound
+from requests.exceptions import RequestException
+
+from ..utils import *    # Various utilities
+from ..errors import *   # All of our error types
+from .base import Backend
+from .coalescer import Coalescer
+
+from threading import Lock
+
+class ContainerBackend(Backend):
+    """Backend spawning containers directly on multiple Docker daemons"""
+    name = "containers"
+
+    def __init__(self, tls_params={}):
+        """
+        Initialize the backend. `tls_params` may hold a `ca_cert` path and a
+        `client_cert` pair of paths used to authenticate to the daemons.
+        """
+        self.logger = logging.getLogger("mettaton.containers")
+
+        # TLS certificate parameters
+        self.tls_params = None
+        if tls_params is not None and tls_params.get("ca_cert") and tls_params.get("client_cert"):
+            self.tls_params = docker.tls.TLSConfig(
+                ca_cert=tls_params.get("ca_cert"),
+                client_cert=tls_params.get("client_cert")
+            )
+
+        # Docker connections
+        self.clients_lock = Lock()
+        self.clients = {}
+
+        # Concurrent identical reads share a single request
+        self.coalescer = Coalescer()
+
+    def _client(self, endpoint: str) -> docker.DockerClient:
+        """Return the client of `endpoint`"""
+        with self.clients_lock:
+            client = self.clients.get(endpoint)
+        if client is None:
+            raise MettatonError("Attempting connection to unknown client {}".format(endpoint), host=endpoint)
+        return client
+
+    def connect(self, endpoint: str):
+        try:
+            client = docker.DockerClient(
+                    base_url=format(endpoint),
+                    tls=self.tls_params
+            )
+        except (DockerException, RequestException) as error:
+            self.logger.fatal("Fatal error when initializing Docker daemon connection to %s : %s", endpoint, error)
+            raise produce_appropriate_exception(error, host=endpoint) from None
+        with self.clients_lock:
+            self.clients[endpoint] = client
+
+    def disconnect(self, endpoint: str):
+        with self.clients_lock:
+            client = self.clients.pop(endpoint, None)
+        if client is None:
+            return
+        try:
+            client.close()
+        except Exception as error:
+            self.logger.debug("Error closing connection to %s: %s", endpoint, error)
+
+    def endpoints(self) -> list:
+        with self.clients_lock:
+            return list(self.clients.keys())
+
+    def ping(self, endpoint: str) -> bool:
+        return self._client(endpoint).ping()
+
+    def spawn(self, endpoint: str, spec: dict, **options) -> str:
+        """
+        The container is created then started, so that a container that fails
+        to start (on a port published behind our back, for instance) is removed
+        instead of holding on to its name.
+        """
+        client = self._client(endpoint)
+        arguments = dict(
+                detach = True,
+                name = spec["name"],
+                restart_policy = { "Name": "always" },
+                network_mode = "bridge",
+                ports = spec["port_config"],
+                environment = spec["environment"],
+                **options)
+        try:
+            try:
+                container = client.containers.create(spec["image"], **arguments)
+            except DockerImageNotFound:
+                client.images.pull(spec["image"])
+                container = client.containers.create(spec["image"], **arguments)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint) from None
+
+        try:
+            container.start()
+        except BaseException as error:
+            try:
+                container.remove(force=True)
+            except (DockerException, RequestException) as cleanup_error:
+                self.logger.error("Could not remove container %s after it failed to start: %s",
+                        container.id, cleanup_error)
+            if isinstance(error, (DockerException, RequestException)):
+                raise produce_appropriate_exception(error, host=endpoint) from None
+            raise
+        return container.id
+
+    def stop(self, endpoint: str, ident: str, timeout: float = None):
+        client = self._client(endpoint)
+        try:
+            if timeout is None:
+                client.api.stop(ident)
+            else:
+                # Docker only takes whole seconds, never cut the grace period short
+                client.api.stop(ident, timeout=math.ceil(timeout))
+            client.api.remove_container(ident)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint, instance=ident) from None
+
+    def _inspect(self, endpoint: str, ident: str) -> dict:
+        """Return the attributes of container `ident` on `endpoint`"""
+        client = self._client(endpoint)
+        try:
+            return self.coalescer.call(("inspect", endpoint, ident),
+                    client.api.inspect_container, ident)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint, instance=ident) from None
+
+    def status(self, endpoint: str, ident: str) -> str:
+        return self._inspect(endpoint, ident)["State"]["Status"]
+
+    def health(self, endpoint: str, idents: list) -> dict:
+        """
+        The health is obtained from the attributes of the inspected container,
+        in ['State']['Health']['Status'], and falls back on its run status for
+        containers without a health check.
+        """
+        result = {}
+        for ident in idents:
+            try:
+                state = self._inspect(endpoint, ident)["State"]
+            except NoSuchInstance:
+                result[ident] = "NOT_FOUND"
+                continue
+            except RuntimeError as error:
+                # The endpoint probes will decide whether the host is gone
+                self.logger.warning("Could not inspect %s on %s: %s", ident, endpoint, error)
+                continue
+            result[ident] = state.get("Health", {}).get("Status", state["Status"])
+        return result
+
+    def published_ports(self, endpoint: str) -> set:
+        """Ports published by the running containers, with a single listing"""
+        client = self._client(endpoint)
+        try:
+            containers = self.coalescer.call(("containers", endpoint), client.api.containers)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint) from None
+        return {(binding["PublicPort"], binding.get("Type", "tcp"))
+                for container in containers
+                for binding in container.get("Ports") or []
+                if binding.get("PublicPort")}
+
+    def activity(self, endpoint: str, idents: list, since: float) -> dict:
+        """
+        Network counters come from a single non-streamed stats sample of every
+        container, and log lines from the logs written since `since`.
+        """
+        client = self._client(endpoint)
+        result = {}
+        for ident in idents:
+            try:
+                stats = self.coalescer.call(("stats", endpoint, ident),
+                        client.api.stats, ident, stream=False, one_shot=True)
+                logs = client.api.logs(ident, since=since)
+            except (DockerException, RequestException) as error:
+                self.logger.warning("Could not collect the activity of %s on %s: %s", ident, endpoint, error)
+                continue
+            network = sum(interface.get("rx_bytes", 0) + interface.get("tx_bytes", 0)
+                    for interface in (stats.get("networks") or {}).values())
+            result[ident] = (network, logs.count(b"\n"))
+        return result
+
+    def checkpoint(self, endpoint: str, ident: str, repository: str, tag: str = None) -> str:
+        client = self._client(endpoint)
+        try:
+            image = client.api.commit(ident, repository=repository, tag=tag,
+                    message="Checkpoint of idle instance {}".format(ident))
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint, instance=ident) from None
+        return image["Id"]
+
+    def call_stats(self) -> dict:
+        return self.coalescer.stats()
+
+    def logs(self, endpoint: str, ident: str, **kwargs):
+        """Streams are never shared, other log reads with the same arguments are"""
+        client = self._client(endpoint)
+        try:
+            if kwargs.get("stream") or kwargs.get("follow"):
+                return client.api.logs(ident, **kwargs)
+            return self.coalescer.call(("logs", endpoint, ident, tuple(sorted(kwargs.items()))),
+                    client.api.logs, ident, **kwargs)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint, instance=ident) from None
@@ -0,0 +1,164 @@
+"""
+In-memory backend
+Simulates hosts and instances without any daemon, for tests and benchmarks
+"""
+
+import logging  # logging library
+import time     # To simulate latency
+
+from ..utils import *    # Various utilities
+from ..errors import *   # All of our error types
+from .base import Backend
+
+from threading import Lock
+
+class MemoryBackend(Backend):
+    """
+    Backend keeping fake instances in memory. It reproduces the errors
+    Docker raises on name and port collisions, can simulate the round-trip
+    `latency` of a daemon on every call, and hosts can be killed to test
+    failure handling. Instances only show activity when `traffic` is called.
+    """
+    name = "memory"
+
+    def __init__(self, latency: float = 0.0):
+        self.logger = logging.getLogger("mettaton.memory")
+        self.latency = latency
+        self.lock = Lock()
+        # Instances of every host, by identifier
+        self.hosts = {}
+        # Hosts we are connected to
+        self.connected = set()
+        # Hosts that stopped answering
+        self.dead = set()
+        # Checkpointed images, by identifier
+        self.images = {}
+
+    def _call(self, endpoint: str) -> dict:
+        """Simulate a call to `endpoint`, returning its instances"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if endpoint in self.dead:
+                raise DaemonUnavailable("Cannot reach {}".format(endpoint), host=endpoint)
+            if not endpoint in self.connected:
+                raise MettatonError("Attempting connection to unknown client {}".format(endpoint), host=endpoint)
+            return self.hosts[endpoint]
+
+    def kill(self, endpoint: str):
+        """Make `endpoint` stop answering"""
+        with self.lock:
+            self.dead.add(endpoint)
+
+    def revive(self, endpoint: str):
+        """Make `endpoint` answer again"""
+        with self.lock:
+            self.dead.discard(endpoint)
+
+    def connect(self, endpoint: str):
+        with self.lock:
+            if endpoint in self.dead:
+                raise DaemonUnavailable("Cannot reach {}".format(endpoint), host=endpoint)
+            self.hosts.setdefault(endpoint, {})
+            self.connected.add(endpoint)
+
+    def disconnect(self, endpoint: str):
+        # The instances of a host outlive our connection to it
+        with self.lock:
+            self.connected.discard(endpoint)
+
+    def endpoints(self) -> list:
+        with self.lock:
+            return list(self.connected)
+
+    def ping(self, endpoint: str) -> bool:
+        self._call(endpoint)
+        return True
+
+    def spawn(self, endpoint: str, spec: dict, **options) -> str:
+        instances = self._call(endpoint)
+        published = port_bindings(spec["port_config"])
+        with self.lock:
+            for instance in instances.values():
+                if instance["name"] == spec["name"]:
+                    raise ContainerNameAlreadyInuse(
+                            "The name {} is already in use".format(spec["name"]), host=endpoint)
+                collisions = published & port_bindings(instance["port_config"])
+                if collisions:
+                    raise DockerNetworkPortAlreadyAllocated("port is already allocated",
+                            host=endpoint, port=min(collisions)[0])
+            ident = generate_identifier()
+            instances[ident] = {
+                "name": spec["name"],
+                "port_config": dict(spec["port_config"] or {}),
+                "status": "running",
+                "logs": b"",
+                "network": 0,
+                "log_times": []
+            }
+        return ident
+
+    def stop(self, endpoint: str, ident: str, timeout: float = None):
+        instances = self._call(endpoint)
+        with self.lock:
+            if instances.pop(ident, None) is None:
+                raise NoSuchInstance("No instance {} on {}".format(ident, endpoint),
+                        host=endpoint, instance=ident)
+
+    def status(self, endpoint: str, ident: str) -> str:
+        instances = self._call(endpoint)
+        with self.lock:
+            if not ident in instances:
+                raise NoSuchInstance("No instance {} on {}".format(ident, endpoint),
+                        host=endpoint, instance=ident)
+            return instances[ident]["status"]
+
+    def health(self, endpoint: str, idents: list) -> dict:
+        try:
+            instances = self._call(endpoint)
+        except RuntimeError:
+            return {}
+        with self.lock:
+            return {ident: "healthy" if ident in instances else "NOT_FOUND" for ident in idents}
+
+    def published_ports(self, endpoint: str) -> set:
+        instances = self._call(endpoint)
+        with self.lock:
+            return {binding for instance in instances.values()
+                    for binding in port_bindings(instance["port_config"])}
+
+    def traffic(self, endpoint: str, ident: str, network: int = 0, log_lines: int = 0):
+        """Simulate `network` bytes exchanged and `log_lines` lines logged by instance `ident`"""
+        with self.lock:
+            instance = self.hosts[endpoint][ident]
+            instance["network"] += network
+            instance["logs"] += b"activity\n" * log_lines
+            instance["log_times"] += [time.time()] * log_lines
+
+    def activity(self, endpoint: str, idents: list, since: float) -> dict:
+        instances = self._call(endpoint)
+        with self.lock:
+            return {ident: (instances[ident]["network"],
+                    len([stamp for stamp in instances[ident]["log_times"] if stamp >= since]))
+                    for ident in idents if ident in instances}
+
+    def checkpoint(self, endpoint: str, ident: str, repository: str, tag: str = None) -> str:
+        instances = self._call(endpoint)
+        with self.lock:
+            if not ident in instances:
+                raise NoSuchInstance("No instance {} on {}".format(ident, endpoint),
+                        host=endpoint, instance=ident)
+            image = generate_identifier()
+            self.images[image] = (repository, tag)
+        return image
+
+    def logs(self, endpoint: str, ident: str, **kwargs):
+        instances = self._call(endpoint)
+        with self.lock:
+            if not ident in instances:
+                raise NoSuchInstance("No instance {} on {}".format(ident, endpoint),
+                        host=endpoint, instance=ident)
+            logs = instances[ident]["logs"]
+        if kwargs.get("stream"):
+            return iter([logs])
+        return logs
@@ -0,0 +1,192 @@
+"""
+Swarm services backend
+Runs every instance as a single replica service of a Docker swarm
+"""
+
+import docker   # engine
+import logging  # logging library
+# Errors from docker's library
+from docker.errors import DockerException
+from requests.exceptions import RequestException
+from docker.types.services import EndpointSpec
+from docker.types import ServiceMode
+
+from ..utils import *    # Various utilities
+from ..errors import *   # All of our error types
+from .base import Backend
+from .coalescer import Coalescer
+
+from threading import Lock
+
+# Endpoint name used to reach the manager described by the environment
+LOCAL_ENDPOINT = "local"
+# Label put on every service we create, to find them back
+MANAGED_LABEL = "mettaton.managed"
+
+class SwarmBackend(Backend):
+    """
+    Backend creating swarm services through a manager node. Endpoints are
+    managers, and the swarm itself decides which node runs the tasks.
+    """
+    name = "swarm"
+
+    def __init__(self):
+        self.logger = logging.getLogger("mettaton.swarm")
+
+        # Docker connections to managers
+        self.clients_lock = Lock()
+        self.clients = {}
+
+        # Concurrent identical reads share a single request
+        self.coalescer = Coalescer()
+
+    def client(self, endpoint: str) -> docker.DockerClient:
+        """Return the client connected to the manager `endpoint`"""
+        with self.clients_lock:
+            client = self.clients.get(endpoint)
+        if client is None:
+            raise MettatonError("Attempting connection to unknown manager {}".format(endpoint), host=endpoint)
+        return client
+
+    def connect(self, endpoint: str):
+        """
+        Connect to the manager `endpoint`. The special endpoint `LOCAL_ENDPOINT`
+        uses the configuration of the environment.
+        """
+        try:
+            if endpoint == LOCAL_ENDPOINT:
+                client = docker.from_env()
+            else:
+                client = docker.DockerClient(base_url=format(endpoint))
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint) from None
+        with self.clients_lock:
+            self.clients[endpoint] = client
+
+    def disconnect(self, endpoint: str):
+        with self.clients_lock:
+            client = self.clients.pop(endpoint, None)
+        if client is None:
+            return
+        try:
+            client.close()
+        except Exception as error:
+            self.logger.debug("Error closing connection to %s: %s", endpoint, error)
+
+    def endpoints(self) -> list:
+        with self.clients_lock:
+            return list(self.clients.keys())
+
+    def ping(self, endpoint: str) -> bool:
+        return self.client(endpoint).ping()
+
+    def spawn(self, endpoint: str, spec: dict, constraints=[], **options) -> str:
+        """
+        Create a service with one replica. The `port_config` of the spec maps
+        internal ports ("25565/tcp" or 25565) to the port published on the swarm.
+        """
+        ports = {}
+        for internal, published in (spec["port_config"] or {}).items():
+            target, _, protocol = str(internal).partition("/")
+            ports[int(published)] = (int(target), protocol or "tcp")
+
+        labels = {**options.pop("labels", {}), MANAGED_LABEL: "true"}
+        try:
+            service = self.client(endpoint).services.create(
+                    spec["image"],
+                    name = spec["name"],
+                    env = spec["environment"],
+                    labels = labels,
+                    constraints = constraints,
+                    maxreplicas = 1,
+                    mode = ServiceMode("replicated", replicas=1),
+                    endpoint_spec = EndpointSpec(ports = ports),
+                    **options)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint) from None
+        return service.id
+
+    def stop(self, endpoint: str, ident: str, timeout: float = None):
+        """Removing a service stops its tasks with their own grace period, `timeout` is ignored"""
+        try:
+            self.client(endpoint).api.remove_service(ident)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint, instance=ident) from None
+
+    def _tasks(self, endpoint: str, idents: list) -> dict:
+        """
+        Return the most recent task of every service in `idents` with a
+        single task listing.
+        """
+        try:
+            tasks = self.coalescer.call(("tasks", endpoint, tuple(sorted(idents))),
+                    self.client(endpoint).api.tasks, filters={"service": list(idents)})
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint) from None
+
+        latest = {}
+        for task in tasks:
+            service = task.get("ServiceID")
+            if service not in latest or task.get("CreatedAt", "") > latest[service].get("CreatedAt", ""):
+                latest[service] = task
+        return latest
+
+    def status(self, endpoint: str, ident: str) -> str:
+        task = self._tasks(endpoint, [ident]).get(ident)
+        if task is None:
+            raise NoSuchInstance("No task for service {} on {}".format(ident, endpoint),
+                    host=endpoint, instance=ident)
+        return task["Status"]["State"]
+
+    def health(self, endpoint: str, idents: list) -> dict:
+        """
+        The health of a service is the state of its most recent task
+        ("new", "pending", "running", "failed", ...), and all of them are
+        obtained with a single task listing.
+        """
+        if len(idents) == 0:
+            return {}
+        try:
+            latest = self._tasks(endpoint, idents)
+        except RuntimeError as error:
+            self.logger.warning("Could not list tasks on %s: %s", endpoint, error)
+            return {}
+        return {ident: latest[ident]["Status"]["State"] if ident in latest else "NOT_FOUND"
+                for ident in idents}
+
+    def published_ports(self, endpoint: str) -> set:
+        """Ports published by every service of the swarm, with a single listing"""
+        try:
+            services = self.coalescer.call(("services", endpoint), self.client(endpoint).api.services)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint) from None
+        return {(binding["PublishedPort"], binding.get("Protocol", "tcp"))
+                for service in services
+                for binding in service.get("Endpoint", {}).get("Ports") or []
+                if binding.get("PublishedPort")}
+
+    def call_stats(self) -> dict:
+        return self.coalescer.stats()
+
+    def logs(self, endpoint: str, ident: str, **kwargs):
+        """Service logs are always streamed, and thus never shared, `stream=True` means following them"""
+        if kwargs.pop("stream", False):
+            kwargs["follow"] = True
+        try:
+            return self.client(endpoint).api.service_logs(ident,
+                    stdout=kwargs.pop("stdout", True), stderr=kwargs.pop("stderr", True),
+                    **kwargs)
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint, instance=ident) from None
+
+    def list_services(self, endpoint: str) -> list:
+        """
+        List the identifiers of the services managed by Mettaton in the swarm
+        with a single filtered query.
+        """
+        try:
+            services = self.coalescer.call(("managed_services", endpoint),
+                    self.client(endpoint).services.list, filters={"label": MANAGED_LABEL})
+        except (DockerException, RequestException) as error:
+            raise produce_appropriate_exception(error, host=endpoint) from None
+        return [service.id for service in services]
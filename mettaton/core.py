@@ -0,0 +1,820 @@
+"""
+Orchestrator core
+Scheduling, state, health and failover shared by every backend
+"""
+import logging  # logging library
+import random
+import time
+import weakref
+
+from .utils import *    # Various utilities
+from .errors import *   # All of our error types
+from .persistence import save_state, load_state, discard_state
+from .healthchecker import HealthChecker
+from .reaper import Reaper
+from .fleet import Fleet
+from .backends import Backend
+
+from threading import Thread, Lock, Event
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+
+# Fields of the spawn specification recorded for every instance
+SPEC_FIELDS = ("image", "name", "environment", "port_config", "created")
+# Host port value asking for a free port to be picked for us
+AUTO_PORT = "auto"
+# Seconds an instance is given to exit when no grace period is asked for (Docker's default)
+STOP_GRACE_PERIOD = 10
+
+class Orchestrator:
+    """
+    The orchestrator core. It schedules game server instances on the endpoints
+    of a `Backend`, keeps track of them and of their spawn specification,
+    persists its state and watches their health.
+    """
+    def __init__(self, backend: Backend, servers_ips=[], storage_path="/tmp/mettaton.state",
+            failover=True, suspect_threshold=2, dead_threshold=5, failover_workers=8,
+            port_range=(30000, 32767), idle_policy=None, restore=True):
+        """Initialize an orchestrator over `backend`, connected to `servers_ips`.
+
+        When `failover` is enabled, endpoints that fail `dead_threshold`
+        consecutive liveness probes are dropped and their instances are
+        rescheduled on the remaining hosts, using up to `failover_workers`
+        parallel spawns.
+
+        Host ports given as `AUTO_PORT` in a port configuration are picked
+        within the inclusive `port_range`.
+
+        When an `idle_policy` dictionary is given, instances that stay idle are
+        stopped and removed by a `Reaper` built with it as keyword arguments
+        (`timeout`, `interval`, `min_bytes`, `min_log_lines`, `checkpoint`
+        and `batch_size`).
+
+        Unless `restore` is disabled, the previous state is loaded right away,
+        which reconnects to the servers it lists.
+        """
+        # Valid state?
+        self.valid_lock = Lock()
+        self.valid = True
+
+        # The logger
+        self.logger = logging.getLogger("mettaton")
+
+        # Path to persistent state storage, and the lock serializing its writes
+        self.storage_path = storage_path
+        self.state_lock = Lock()
+
+        # What actually runs the instances
+        self.backend = backend
+
+        # Instances and the endpoint they run on
+        self.instances_lock = Lock()
+        self.instances = {}
+        # Spawn specifications of the instances, protected by `instances_lock`
+        self.specs = {}
+        # Spawn specifications of the instances lost in a failover that could
+        # not be placed yet, protected by `instances_lock`
+        self.pending = {}
+        # Only one attempt at placing them at a time
+        self.pending_lock = Lock()
+        # Queryable view of the instances
+        self.fleet = Fleet()
+
+        # Host ports published on every endpoint, as a dictionary of
+        # `(port, protocol)` and the instance owning them (`None` if not ours)
+        self.ports_lock = Lock()
+        self.port_index = {}
+        self.port_range = port_range
+
+        # Failover configuration
+        self.failover = failover
+        self.failover_workers = failover_workers
+
+        # Nurse/Health Watch daemon
+        # It only keeps a weak reference to us, so that dropping
+        # the orchestrator still shuts it down
+        on_endpoint_dead = weakref.WeakMethod(self._on_endpoint_dead)
+        on_endpoint_reconnected = weakref.WeakMethod(self._on_endpoint_reconnected)
+        on_endpoint_alive = weakref.WeakMethod(self._on_endpoint_alive)
+        fleet = self.fleet
+        self.nurse = HealthChecker(self.backend,
+                suspect_threshold = suspect_threshold,
+                dead_threshold = dead_threshold,
+                on_endpoint_dead = lambda endpoint: on_endpoint_dead() and on_endpoint_dead()(endpoint),
+                on_status_change = lambda endpoint, ident, status: fleet.set_health(ident, status),
+                on_endpoint_reconnected = lambda endpoint: on_endpoint_reconnected() and on_endpoint_reconnected()(endpoint),
+                on_endpoint_alive = lambda endpoint: on_endpoint_alive() and on_endpoint_alive()(endpoint))
+        self.event_queue = self.nurse.get_event_queue()
+        self.nurse.start()
+
+        # Idle instances reaper
+        self.reaper = None
+        if idle_policy is not None:
+            reap_instances = weakref.WeakMethod(self.reap_instances)
+            self.reaper = Reaper(self.backend, self.fleet,
+                    on_idle = lambda batch: reap_instances() and reap_instances()(batch),
+                    **idle_policy)
+            self.reaper.start()
+        self.logger.info("Built Mettaton (%s backend)", self.backend.name)
+
+        # Build any connection that's provided to us
+        self.build_connections(servers_ips)
+
+        # Attempt to load previous state, which may add connections
+        if restore:
+            self.load_state()
+
+    def __del__(self):
+        # Game servers are never stopped implicitly, only let go of
+        with self.valid_lock:
+            valid = self.valid
+        if valid:
+            self.shutdown(detach=True)
+
+    def disconnect_from_endpoint(self, endpoint: str, grace_period=None, deadline=None):
+        """
+        Shut down every instance of `endpoint` and disconnect from it.
+        See `drain` for `grace_period` and `deadline`.
+        """
+        if not endpoint in self.backend.endpoints():
+            return
+        with self.instances_lock:
+            hosted = [instance_id for instance_id, host in self.instances.items()
+                    if host == endpoint]
+        self.drain(hosted, grace_period=grace_period, deadline=deadline)
+        self.backend.disconnect(endpoint)
+        self.nurse.disconnect(endpoint)
+        with self.ports_lock:
+            self.port_index.pop(endpoint, None)
+
+    def _state_servers(self) -> list:
+        """Return the endpoints recorded in the state"""
+        servers = self.backend.endpoints()
+        # Endpoints we are still trying to reconnect to are kept
+        servers += [endpoint for endpoint in self.nurse.get_reconnecting()
+                if not endpoint in servers]
+        return servers
+
+    def save_state(self, servers=None):
+        """
+        Save current state to persistent storage, recording `servers` as
+        endpoints (those we are connected or reconnecting to by default)
+        """
+        self.logger.info("Saving state to storage...")
+        try:
+            # The snapshot is taken under the state lock, so that the last
+            # write always holds the most recent state
+            with self.state_lock:
+                with self.instances_lock:
+                    records = {}
+                    for ident, host in self.instances.items():
+                        records[ident] = {"host": host, **self.specs.get(ident, {})}
+                    # Instances waiting for a host have none
+                    for ident, spec in self.pending.items():
+                        records[ident] = {"host": None, **spec}
+                if servers is None:
+                    servers = self._state_servers()
+                save_state(self.storage_path, servers, records)
+        except Exception as e:
+            self.logger.error("%s", e)
+        else:
+            self.logger.info("Success")
+
+    def load_state(self):
+        """
+        Load a previous state from persistent storage.
+        Instances are restored from their recorded specifications without
+        querying the backend, and handed to the nurse which will report those
+        that no longer exist. Servers we cannot reconnect to are handed to the
+        nurse as suspect: it keeps trying to reconnect, and only fails their
+        instances over once they are declared dead.
+        """
+        self.logger.info("Reloading older state from persistent storage")
+        try:
+            state = load_state(self.storage_path)
+        except SaveStateParseError:
+            self.logger.error("Unable to parse saved state")
+        except RuntimeError as error:
+            self.logger.error("Could not load state: %s", error)
+        except FileNotFoundError as error:
+            self.logger.error("No previous state found. Saving.")
+            self.save_state()
+        else:
+            self._restore(state)
+            self.logger.info("Successfully reloaded state")
+
+    def _restore(self, state):
+        """Rebuild connections and instances from a loaded `state`"""
+        for endpoint in state["servers"]:
+            try:
+                self.build_connections([endpoint])
+            except RuntimeError as error:
+                # Let the probes decide whether it is gone for good
+                self.logger.error("Could not reconnect to %s, will keep trying: %s", endpoint, error)
+                self.nurse.add_connection(endpoint, connected=False)
+
+        known = set(self.backend.endpoints()) | set(self.nurse.get_reconnecting())
+        unknown = set()
+        with self.instances_lock:
+            for ident, record in state["instances"].items():
+                host = record["host"]
+                if host is None:
+                    if record["image"] is not None:
+                        self.pending[ident] = {field: record[field] for field in SPEC_FIELDS}
+                    continue
+                self.instances[ident] = host
+                if record["image"] is not None:
+                    self.specs[ident] = {field: record[field] for field in SPEC_FIELDS}
+                self.fleet.add(ident, host, self.specs.get(ident))
+                if host in known:
+                    self.nurse.watch_for(host, ident)
+                else:
+                    unknown.add(host)
+        with self.ports_lock:
+            for ident, record in state["instances"].items():
+                if record["host"] is not None and record["host"] in known:
+                    index = self.port_index.setdefault(record["host"], {})
+                    for binding in port_bindings(record["port_config"]):
+                        index[binding] = ident
+        self.logger.info("Restored %d instances", len(state["instances"]))
+
+        for host in unknown:
+            # Not even listed in the servers of the state
+            self.logger.error("Host %s is not known, its instances are lost", host)
+            self._on_endpoint_dead(host)
+        self._retry_pending()
+
+    def build_connections(self, endpoint_list):
+        """Build the dictionary of known connections from the given IP list"""
+        known = self.backend.endpoints()
+        for endpoint in endpoint_list:
+            if endpoint in known:
+                self.logger.info("Not renewing connection to endpoint %s", endpoint)
+                continue
+            self.backend.connect(endpoint)
+            self.logger.info("Successful initial connection to %s", endpoint)
+            self.nurse.add_connection(endpoint)
+            self.refresh_port_index(endpoint)
+            self._retry_pending()
+
+    def refresh_port_index(self, endpoint):
+        """
+        Rebuild the port index of `endpoint` from the ports actually published
+        there, which includes those of containers we do not manage.
+        """
+        try:
+            published = self.backend.published_ports(endpoint)
+        except RuntimeError as error:
+            self.logger.warning("Could not list the ports published on %s: %s", endpoint, error)
+            return
+        with self.ports_lock:
+            index = dict.fromkeys(published)
+            # Our instances and the spawns in flight keep their owner
+            for binding, owner in self.port_index.get(endpoint, {}).items():
+                if owner is not None:
+                    index[binding] = owner
+            self.port_index[endpoint] = index
+
+    def _reserve_ports(self, host, port_config, owner):
+        """
+        Check the host ports of `port_config` against the index of `host`, and
+        reserve them for `owner`. `AUTO_PORT` values are replaced with a free
+        port. Returns the resolved port configuration.
+        Must be called with the ports lock held.
+        """
+        index = self.port_index.setdefault(host, {})
+        resolved = {}
+        wanted = set()
+        for internal, binding in port_config.items():
+            protocol = str(internal).partition("/")[2] or "tcp"
+            if binding == AUTO_PORT:
+                binding = next((port for port in range(self.port_range[0], self.port_range[1] + 1)
+                    if not (port, protocol) in index and not (port, protocol) in wanted), None)
+                if binding is None:
+                    raise DockerNetworkPortAlreadyAllocated(
+                            "No free {} port left on {}".format(protocol, host), host=host)
+            resolved[internal] = binding
+            for port in host_ports(binding):
+                if (port, protocol) in index or (port, protocol) in wanted:
+                    raise DockerNetworkPortAlreadyAllocated(
+                            "Port {}/{} is already allocated on {}".format(port, protocol, host),
+                            host=host, port=port)
+                wanted.add((port, protocol))
+        for binding in wanted:
+            index[binding] = owner
+        return resolved
+
+    def _release_ports(self, host, owner):
+        """Remove the ports of `owner` from the index of `host`"""
+        with self.ports_lock:
+            index = self.port_index.get(host, {})
+            for binding in [binding for binding, known in index.items() if known == owner]:
+                del index[binding]
+
+    def _place(self, host=None, exclude=(), port_config={}, owner=None):
+        """
+        Pick `host` if it is one of our endpoints, or a random healthy
+        endpoint that is not in `exclude` if none is given, on which the
+        host ports of `port_config` are free, and reserve them for `owner`.
+        Returns the host and the resolved port configuration.
+        """
+        endpoints = self.backend.endpoints()
+        # If a host is provided, use it
+        if host is not None:
+            if not host in endpoints:
+                raise MettatonError("Attempting connection to unknown client {}".format(host), host=host)
+            candidates = [host]
+        else:
+            candidates = [endpoint for endpoint in endpoints
+                    if endpoint not in exclude
+                    and self.nurse.get_endpoint_state(endpoint) == "HOST_ALIVE"]
+            if len(candidates) == 0:
+                raise NoHostAvailable("No host available to deploy right now")
+            random.shuffle(candidates)
+
+        with self.ports_lock:
+            for candidate in candidates:
+                try:
+                    return candidate, self._reserve_ports(candidate, port_config, owner)
+                except DockerNetworkPortAlreadyAllocated as error:
+                    collision = error
+        raise collision
+
+    def _spawn(self, image, name, environment, port_config, host, exclude=(), **options):
+        """
+        Create an instance on `host`, or on a random healthy host that is
+        not in `exclude` if none is given, and register it along with its
+        spawn specification. Neither saves the state nor tells the nurse.
+        """
+        # Ports are held by a placeholder until we know the identifier
+        placeholder = object()
+        host, port_config = self._place(host, exclude, dict(port_config or {}), placeholder)
+        spec = {
+            "image": image,
+            "name": name,
+            "environment": dict(environment or {}),
+            "port_config": port_config,
+            "created": time.time()
+        }
+        try:
+            ident = self.backend.spawn(host, spec, **options)
+        except BaseException as error:
+            # Whatever went wrong, the placeholder must not keep the ports
+            self._release_ports(host, placeholder)
+            if isinstance(error, DockerNetworkPortAlreadyAllocated):
+                # Someone published it behind our back
+                self.refresh_port_index(host)
+            self.logger.error("%s", error)
+            raise
+
+        # Save the instance
+        with self.ports_lock:
+            index = self.port_index.setdefault(host, {})
+            for binding in port_bindings(port_config):
+                index[binding] = ident
+        with self.instances_lock:
+            self.instances[ident] = host
+            self.specs[ident] = spec
+        self.fleet.add(ident, host, spec)
+        self.logger.info("Successful creation of instance %s named %s (image %s) on %s", ident, name, image, host)
+        return host, ident
+
+    def start_server(self, image, name, environment={}, port_config={}, host=None, **options):
+        """
+        Start a game server somewhere in one of our managed connections.
+        `options` are handed to the backend as they are.
+        """
+        host, ident = self._spawn(image, name, environment, port_config, host, **options)
+
+        self.save_state()
+        # Tell the nurse to check on them
+        self.nurse.watch_for(host, ident)
+
+        return host, ident
+
+    def start_servers(self, launches, workers=8):
+        """
+        Start several game servers at once. `launches` is a list of dictionaries
+        holding the arguments of `start_server`. Instances are spawned in parallel
+        by up to `workers` threads and the state is saved once.
+
+        Returns a list with, for every launch in order, either the host and
+        identifier of the instance, or the exception that prevented its creation.
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._spawn,
+                    launch["image"], launch["name"],
+                    launch.get("environment"), launch.get("port_config"),
+                    launch.get("host"), **launch.get("options", {}))
+                for launch in launches]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    # One failed launch must not cost the others their state
+                    results.append(error)
+
+        self.save_state()
+        for result in results:
+            if not isinstance(result, Exception):
+                self.nurse.watch_for(*result)
+        return results
+
+    def _on_endpoint_reconnected(self, endpoint):
+        """
+        Callback used by the nurse when it managed to reconnect to an endpoint
+        it could not reach when we started
+        """
+        self.logger.info("Reconnected to %s", endpoint)
+        self.refresh_port_index(endpoint)
+        self.save_state()
+
+    def _on_endpoint_alive(self, endpoint):
+        """
+        Callback used by the nurse when an endpoint becomes alive again,
+        which may make room for the pending instances
+        """
+        self._retry_pending()
+
+    def _retry_pending(self):
+        """Try and place the pending instances in the background, if there are any"""
+        with self.instances_lock:
+            if len(self.pending) == 0:
+                return
+        Thread(target=self.place_pending, name="mettaton-pending", daemon=True).start()
+
+    def get_pending_instances(self):
+        """
+        Return the identifiers of the instances lost in a failover that are
+        waiting for a host to be rescheduled on
+        """
+        with self.instances_lock:
+            return list(self.pending.keys())
+
+    def place_pending(self):
+        """
+        Try and reschedule every pending instance on the healthy hosts.
+        Done automatically whenever a host connects or becomes alive again.
+
+        Returns a dictionary mapping the identifier of every pending instance
+        to the `(host, identifier)` of its replacement, or to `None` if it
+        is still pending.
+        """
+        with self.pending_lock:
+            with self.instances_lock:
+                pending = dict(self.pending)
+            if len(pending) == 0:
+                return {}
+            replacements = self._reschedule(pending)
+            for instance_id, replacement in replacements.items():
+                if replacement is None:
+                    continue
+                self.nurse.watch_for(*replacement)
+                self.event_queue.put((replacement, "RESCHEDULED"))
+                self.logger.info("Rescheduled pending %s as %s on %s", instance_id,
+                        replacement[1], replacement[0])
+            self.save_state()
+            return replacements
+
+    def _reschedule(self, specs, exclude=()):
+        """
+        Spawn a replacement for every instance of `specs`, a dictionary of
+        identifiers and spawn specifications, in parallel on healthy hosts not
+        in `exclude`. Instances that cannot be placed are kept pending along
+        with their specification, and the others are no longer pending.
+        Neither saves the state nor tells the nurse.
+
+        Returns a dictionary mapping every identifier to the `(host, identifier)`
+        of its replacement, or to `None`.
+        """
+        replacements = {}
+        with ThreadPoolExecutor(max_workers=self.failover_workers) as pool:
+            futures = {instance_id: pool.submit(self._spawn,
+                    spec["image"], spec["name"], spec["environment"],
+                    spec["port_config"], None, exclude)
+                for instance_id, spec in specs.items()}
+            for instance_id, future in futures.items():
+                try:
+                    replacements[instance_id] = future.result()
+                except Exception as error:
+                    self.logger.error("Could not reschedule %s, keeping it pending: %s", instance_id, error)
+                    replacements[instance_id] = None
+
+        with self.instances_lock:
+            for instance_id, replacement in replacements.items():
+                if replacement is None:
+                    self.pending[instance_id] = specs[instance_id]
+                else:
+                    self.pending.pop(instance_id, None)
+        return replacements
+
+    def _on_endpoint_dead(self, endpoint):
+        """
+        Callback used by the nurse when an endpoint is declared dead.
+        The failover runs in its own thread so that the nurse keeps checking.
+        """
+        if not self.failover:
+            return
+        Thread(target=self.failover_endpoint, args=(endpoint,),
+                name="mettaton-failover", daemon=True).start()
+
+    def failover_endpoint(self, endpoint):
+        """
+        Drop the connection to `endpoint` and reschedule every instance it
+        hosted on the remaining healthy hosts, in parallel. Instances keep
+        their name, image, environment and port configuration, but get a new
+        identifier.
+
+        Instances that cannot be placed right now are kept pending with their
+        specification, and placed as soon as a host becomes available.
+
+        Returns a dictionary mapping the identifier of every lost instance to
+        the `(host, identifier)` of its replacement, or to `None` if it could
+        not be rescheduled.
+        """
+        self.logger.warning("Failing over instances of endpoint %s", endpoint)
+        with self.instances_lock:
+            lost = {}
+            for instance_id, host in list(self.instances.items()):
+                if host != endpoint:
+                    continue
+                del self.instances[instance_id]
+                lost[instance_id] = self.specs.pop(instance_id, None)
+        for instance_id in lost:
+            self.nurse.unwatch_for(endpoint, instance_id)
+            self.fleet.remove(instance_id)
+            self.event_queue.put(((endpoint, instance_id), "LOST"))
+
+        # The endpoint is gone, do not try and stop anything on it
+        self.backend.disconnect(endpoint)
+        self.nurse.disconnect(endpoint)
+        with self.ports_lock:
+            self.port_index.pop(endpoint, None)
+
+        replacements = {}
+        for instance_id, spec in lost.items():
+            if spec is None:
+                self.logger.error("No spawn specification for %s, it cannot be rescheduled", instance_id)
+                replacements[instance_id] = None
+        with self.pending_lock:
+            replacements.update(self._reschedule({instance_id: spec
+                for instance_id, spec in lost.items() if spec is not None}, (endpoint,)))
+
+        for instance_id, replacement in replacements.items():
+            if replacement is None:
+                if lost[instance_id] is not None:
+                    self.event_queue.put(((endpoint, instance_id), "PENDING"))
+                continue
+            self.nurse.watch_for(*replacement)
+            self.event_queue.put((replacement, "RESCHEDULED"))
+            self.logger.info("Rescheduled %s from %s as %s on %s", instance_id, endpoint,
+                    replacement[1], replacement[0])
+        self.save_state()
+        return replacements
+
+    def get_server_list(self):
+        # Return a list of the servers we are connected to
+        return self.backend.endpoints()
+
+    def get_instance_list(self):
+        # Return a list of instances we have launched
+        with self.instances_lock:
+            return list(self.instances.keys())
+
+    def query(self, host=None, image=None, name=None, health=None,
+            older_than=None, newer_than=None):
+        """
+        Return the `InstanceRecord` of every instance matching all of the given
+        criteria, oldest first, without contacting any daemon. `health` is the
+        last status reported by the nurse, and `older_than` and `newer_than`
+        are ages in seconds.
+        """
+        return self.fleet.query(host=host, image=image, name=name, health=health,
+                older_than=older_than, newer_than=newer_than)
+
+    def snapshot(self):
+        """Return the `InstanceRecord` of every instance, oldest first, without contacting any daemon"""
+        return self.fleet.snapshot()
+
+    def _host_of(self, instance_id):
+        """Return the endpoint running `instance_id`"""
+        with self.instances_lock:
+            host = self.instances.get(instance_id)
+        if host is None:
+            raise NoSuchInstance("No such instance known", instance=instance_id)
+        return host
+
+    def get_logs(self, instance_id, **kwargs):
+        host = self._host_of(instance_id)
+        return self.backend.logs(host, instance_id, **kwargs)
+
+    def get_log_stream(self, instance_id, **kwargs):
+        host = self._host_of(instance_id)
+        return self.backend.logs(host, instance_id, stream=True, **kwargs)
+
+    def get_status(self, instance_id):
+        host = self._host_of(instance_id)
+        return self.backend.status(host, instance_id)
+
+    def get_call_stats(self):
+        """
+        Return the counters of the read calls made to the engine, showing how
+        many were answered by sharing a concurrent identical call
+        """
+        return self.backend.call_stats()
+
+    def subscribe(self):
+        """
+        Subscribe to a Queue of events that will come from the watcher
+        daemon
+        """
+        return self.event_queue
+
+    def _stop_nurse(self, timeout=None):
+        """
+        Destroy the healthwatcher and the reaper, waiting at most `timeout`
+        seconds in total for them to finish what they were doing
+        """
+        end = None if timeout is None else time.time() + timeout
+        if self.reaper is not None:
+            self.reaper.stop()
+        self.nurse.stop()
+        if self.reaper is not None:
+            self.reaper.join(None if end is None else max(0, end - time.time()))
+        self.nurse.join(None if end is None else max(0, end - time.time()))
+
+    def drain(self, instance_ids=None, grace_period=None, deadline=None, workers=32):
+        """
+        Stop and remove the instances `instance_ids` (all of them by default,
+        pending ones included) in parallel, using up to `workers` threads, and
+        save the state once.
+
+        Every instance is given `grace_period` seconds to exit before being
+        killed, the backend default if `None`, and never more than what is left
+        of the `deadline` in seconds. Once the deadline is reached the drain
+        stops waiting, and the instances still being stopped are left recorded
+        in the saved state. Those stops are abandoned, not cancelled: when one
+        still completes, it saves the state again.
+
+        Returns the identifiers of the instances that were not removed.
+        """
+        if instance_ids is None:
+            instance_ids = self.get_instance_list()
+            # Nothing runs them, forgetting them is enough
+            with self.instances_lock:
+                forgotten = len(self.pending)
+                self.pending.clear()
+            if len(instance_ids) == 0 and forgotten > 0:
+                self.save_state()
+        if len(instance_ids) == 0:
+            return []
+
+        end = None if deadline is None else time.time() + deadline
+        # Set when the drain gives up on its stragglers, with the servers to record
+        abandoned = Event()
+        recorded = []
+        stops = Queue()
+        futures = {}
+        for instance_id in instance_ids:
+            future = Future()
+            futures[future] = instance_id
+            stops.put((instance_id, future))
+
+        def work():
+            while True:
+                try:
+                    instance_id, future = stops.get_nowait()
+                except Empty:
+                    return
+                if not future.set_running_or_notify_cancel():
+                    continue
+                timeout = grace_period
+                if end is not None:
+                    # Whatever is still running at the deadline gets killed
+                    left = max(0, end - time.time())
+                    timeout = min(STOP_GRACE_PERIOD if timeout is None else timeout, left)
+                try:
+                    self._stop_instance(instance_id, timeout)
+                except BaseException as error:
+                    future.set_exception(error)
+                    continue
+                future.set_result(None)
+                if abandoned.is_set():
+                    # The drain already saved this instance as remaining
+                    self.save_state(recorded)
+
+        # Daemon threads, so that abandoned stops never hold the process back
+        for _ in range(min(workers, len(instance_ids))):
+            Thread(target=work, name="mettaton-drain", daemon=True).start()
+        _, pending = wait(futures, timeout=deadline)
+
+        if len(pending) > 0:
+            self.logger.error("Drain deadline reached with %d instances left", len(pending))
+            recorded.extend(self._state_servers())
+            abandoned.set()
+        remaining = []
+        for future, instance_id in futures.items():
+            # Stops that did not start by now never will
+            if future.cancel() or not future.done():
+                remaining.append(instance_id)
+            elif future.exception() is not None:
+                self.logger.error("Could not shut %s down: %s", instance_id, future.exception())
+                remaining.append(instance_id)
+        self.save_state(recorded or None)
+        return remaining
+
+    def shutdown(self, detach=False, grace_period=None, deadline=None, workers=32):
+        """
+        Shut mettaton down.
+
+        Unless `detach` is set, every instance is drained: stopped and removed in
+        parallel with a `grace_period` per instance and an overall `deadline`
+        in seconds, see `drain`. The health checker and the reaper are given at
+        most a quarter of the deadline to stop, the rest is left to the drain.
+        When detaching, instances are left running and only the state is saved,
+        so that they are restored on the next start.
+        """
+        end = None if deadline is None else time.time() + deadline
+        if detach:
+            self._stop_nurse(timeout=deadline)
+            self.save_state()
+        else:
+            # The drain must not be starved by the threads we are stopping,
+            # so they only get part of the time
+            self._stop_nurse(timeout=None if deadline is None else deadline / 4)
+            self.drain(grace_period=grace_period,
+                    deadline=None if end is None else max(0, end - time.time()),
+                    workers=workers)
+
+        # Destroy the connections
+        for endpoint in self.backend.endpoints():
+            self.backend.disconnect(endpoint)
+            self.nurse.disconnect(endpoint)
+        with self.ports_lock:
+            self.port_index.clear()
+        self.logger.info("Destroyed mettaton. Bye bye.")
+        self.valid_lock.acquire()
+        self.valid = False
+        self.valid_lock.release()
+
+    def shutdown_server(self, instance_id, timeout=None):
+        """
+        Stop and remove an instance, giving it `timeout` seconds to exit
+        before killing it (the backend default if `None`)
+        """
+        self._stop_instance(instance_id, timeout)
+        self.save_state()
+
+    def _stop_instance(self, instance_id, timeout=None):
+        """Stop and remove an instance and forget about it, without saving the state"""
+        host = self._host_of(instance_id)
+        self.nurse.unwatch_for(host, instance_id)
+        try:
+            self.backend.stop(host, instance_id, timeout=timeout)
+        except NoSuchInstance:
+            self.logger.warning("Instance %s was already gone from %s", instance_id, host)
+        except RuntimeError:
+            self.nurse.watch_for(host, instance_id)
+            raise
+        self.logger.info("Stopped and removed instance %s on %s", instance_id, host)
+        with self.instances_lock:
+            self.instances.pop(instance_id, None)
+            self.specs.pop(instance_id, None)
+        self.fleet.remove(instance_id)
+        self._release_ports(host, instance_id)
+
+    def reap_instances(self, instances):
+        """
+        Stop and remove several `(host, identifier)` instances in parallel, then
+        clean them out of the nurse, the port index and the state in one batch.
+        Used by the reaper, every reaped instance is announced with a "REAPED"
+        event. Returns the list of instances that were reaped.
+        """
+        self.nurse.unwatch_many(instances)
+        reaped = []
+        with ThreadPoolExecutor(max_workers=self.failover_workers) as pool:
+            futures = {instance: pool.submit(self.backend.stop, *instance) for instance in instances}
+            for (host, instance_id), future in futures.items():
+                try:
+                    future.result()
+                except NoSuchInstance:
+                    self.logger.warning("Instance %s was already gone from %s", instance_id, host)
+                except Exception as error:
+                    self.logger.error("Could not reap %s on %s: %s", instance_id, host, error)
+                    self.nurse.watch_for(host, instance_id)
+                    continue
+                reaped.append((host, instance_id))
+
+        with self.instances_lock:
+            for host, instance_id in reaped:
+                self.instances.pop(instance_id, None)
+                self.specs.pop(instance_id, None)
+        for host, instance_id in reaped:
+            self.fleet.remove(instance_id)
+            self._release_ports(host, instance_id)
+            self.event_queue.put(((host, instance_id), "REAPED"))
+            self.logger.info("Reaped idle instance %s on %s", instance_id, host)
+        if len(reaped) > 0:
+            self.save_state()
+        return reaped
@@ -1,14 +1,33 @@
 """Various error types"""
 
-class SaveStateParseError(RuntimeError):
+class MettatonError(RuntimeError):
+    """
+    Base of our error types. Besides its message, an error may carry the
+    `host`, `instance` and `port` it is about, so that callers can react
+    without parsing strings. Fields that do not apply are `None`.
+    """
+    def __init__(self, *args, host=None, instance=None, port=None):
+        RuntimeError.__init__(self, *args)
+        self.host = host
+        self.instance = instance
+        self.port = port
+
+class SaveStateParseError(MettatonError):
     """The save state file has is invalid JSON"""
     pass
 
-class ContainerNameAlreadyInuse(RuntimeError):
+class InstanceConflict(MettatonError):
+    """
+    The request conflicts with the current state of an instance
+    or of the daemon (HTTP 409)
+    """
+    pass
+
+class ContainerNameAlreadyInuse(InstanceConflict):
     """The name for a container we are trying to create is already used by another one"""
     pass
 
-class DockerConnectSSLWrongVersionNumber(RuntimeError):
+class DockerConnectSSLWrongVersionNumber(MettatonError):
     """
     Connection to the Docker socket via SSL failed,
     most likely from your client trying to connect
@@ -16,15 +35,41 @@ class DockerConnectSSLWrongVersionNumber(RuntimeError):
     """
     pass
 
-class DockerNetworkPortAlreadyAllocated(RuntimeError):
+class DockerNetworkPortAlreadyAllocated(MettatonError):
     """
     The network ports being used for forward are already being
     forwarded for another docker container
     """
     pass
 
-class NoHostAvailable(RuntimeError):
+class NoHostAvailable(MettatonError):
     """
     We tried to deploy a container, but we are not connected to any host
     """
     pass
+
+class NoSuchInstance(MettatonError):
+    """
+    The instance we are trying to reach is not known to us,
+    or no longer exists on its host
+    """
+    pass
+
+class ImageNotFound(MettatonError):
+    """
+    The image we are trying to deploy does not exist,
+    or cannot be pulled by the daemon
+    """
+    pass
+
+class DaemonError(MettatonError):
+    """
+    The Docker daemon failed to carry out the request (HTTP 5xx)
+    """
+    pass
+
+class DaemonUnavailable(DaemonError):
+    """
+    The Docker daemon cannot be reached
+    """
+    pass
@@ -0,0 +1,124 @@
+"""
+Fleet model
+In-memory view of every instance, with secondary indexes for local queries
+"""
+
+import bisect
+import time
+from collections import namedtuple
+from threading import Lock
+
+from .utils import port_bindings
+
+# Immutable description of an instance
+InstanceRecord = namedtuple("InstanceRecord",
+        ("ident", "host", "image", "name", "health", "created", "ports"))
+
+class Fleet:
+    """
+    The fleet keeps an `InstanceRecord` for every instance, kept up to date
+    by the orchestrator on spawns, teardowns and health events, and indexed
+    by host, image, name and health, as well as by creation time.
+    Queries never reach the backend.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.records = {}
+        self.by_host = {}
+        self.by_image = {}
+        self.by_name = {}
+        self.by_health = {}
+        # Sorted list of `(created, ident)`
+        self.by_age = []
+
+    def _index(self, record):
+        """Add `record` to every index. Must be called with the lock held."""
+        self.by_host.setdefault(record.host, set()).add(record.ident)
+        self.by_image.setdefault(record.image, set()).add(record.ident)
+        self.by_name.setdefault(record.name, set()).add(record.ident)
+        self.by_health.setdefault(record.health, set()).add(record.ident)
+        bisect.insort(self.by_age, (record.created, record.ident))
+
+    def _unindex(self, record):
+        """Remove `record` from every index. Must be called with the lock held."""
+        for index, key in ((self.by_host, record.host), (self.by_image, record.image),
+                (self.by_name, record.name), (self.by_health, record.health)):
+            idents = index.get(key)
+            idents.discard(record.ident)
+            if len(idents) == 0:
+                del index[key]
+        position = bisect.bisect_left(self.by_age, (record.created, record.ident))
+        del self.by_age[position]
+
+    def add(self, ident: str, host: str, spec: dict, health: str = "UNKNOWN"):
+        """Add or replace the instance `ident` running on `host` from its spawn `spec`"""
+        spec = spec or {}
+        record = InstanceRecord(ident, host, spec.get("image"), spec.get("name"), health,
+                spec.get("created") or 0.0, tuple(sorted(port_bindings(spec.get("port_config")))))
+        with self.lock:
+            previous = self.records.get(ident)
+            if previous is not None:
+                self._unindex(previous)
+            self.records[ident] = record
+            self._index(record)
+
+    def remove(self, ident: str):
+        """Forget about instance `ident`"""
+        with self.lock:
+            record = self.records.pop(ident, None)
+            if record is not None:
+                self._unindex(record)
+
+    def set_health(self, ident: str, health: str):
+        """Update the health of instance `ident`, if we know it"""
+        with self.lock:
+            record = self.records.get(ident)
+            if record is None or record.health == health:
+                return
+            self.by_health[record.health].discard(ident)
+            if len(self.by_health[record.health]) == 0:
+                del self.by_health[record.health]
+            record = record._replace(health=health)
+            self.records[ident] = record
+            self.by_health.setdefault(health, set()).add(ident)
+
+    def get(self, ident: str) -> InstanceRecord:
+        """Return the record of instance `ident`, or `None`"""
+        with self.lock:
+            return self.records.get(ident)
+
+    def snapshot(self) -> tuple:
+        """Return the records of every instance, oldest first"""
+        with self.lock:
+            return tuple(self.records[ident] for (_, ident) in self.by_age)
+
+    def query(self, host=None, image=None, name=None, health=None,
+            older_than=None, newer_than=None) -> tuple:
+        """
+        Return the records of the instances matching every given criterion,
+        oldest first. `older_than` and `newer_than` are ages in seconds.
+        """
+        now = time.time()
+        with self.lock:
+            candidates = None
+            for index, key in ((self.by_host, host), (self.by_image, image),
+                    (self.by_name, name), (self.by_health, health)):
+                if key is None:
+                    continue
+                idents = index.get(key, set())
+                candidates = idents if candidates is None else candidates & idents
+                if len(candidates) == 0:
+                    return ()
+
+            # Creation time boundaries
+            low = now - newer_than if newer_than is not None else float("-inf")
+            high = now - older_than if older_than is not None else float("inf")
+            start = bisect.bisect_left(self.by_age, (low,))
+            end = bisect.bisect_left(self.by_age, (high,))
+            if candidates is not None and len(candidates) < end - start:
+                # Cheaper to sort the few candidates than to walk the range
+                records = [self.records[ident] for ident in candidates]
+                return tuple(sorted((record for record in records if low <= record.created < high),
+                        key=lambda record: (record.created, record.ident)))
+            return tuple(self.records[ident] for (_, ident) in self.by_age[start:end]
+                    if candidates is None or ident in candidates)
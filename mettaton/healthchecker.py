@@ -1,41 +1,70 @@
 """
 Health Checker Mechanism
-Module containing logic to check the state of a docker container
+Module containing logic to check the state of the instances of a backend
 """
 
-import docker   # engine
 import logging  # logging library
 import time     # To check check cycle duration
-# Errors from docker's library
-from docker.errors import DockerException, APIError, NotFound
-from docker.types.services import EndpointSpec
-from docker.types import ServiceMode, Placement
 
 from .utils import *    # Various utilities
 from .errors import *   # All of our error types
-from .persistence import save_state, load_state, discard_state
+from .backends import Backend
 
 from threading import Thread, Lock
 from queue import Queue, Empty
+from concurrent.futures import Future, wait
 
 class HealthChecker(Thread):
     """
     The Health Checker is the thread that runs alongside a Mettaton object
     in order to verify
     """
-    def __init__(self, connections: list[docker.DockerClient]):
+    def __init__(self, backend: Backend,
+            suspect_threshold: int = 2, dead_threshold: int = 5,
+            probe_timeout: float = 2.0, on_endpoint_dead = None, on_status_change = None,
+            on_endpoint_reconnected = None, on_endpoint_alive = None):
         """
         Initialization of a `HealthChecker` object requires nothing more than
-        a list of initial `DockerClient` objects.
+        the `Backend` running the instances. Endpoints to check are added with
+        `add_connection`.
+
+        Endpoints are probed with `ping()` on every cycle. After `suspect_threshold`
+        consecutive failed probes an endpoint is considered suspect, and after
+        `dead_threshold` it is declared dead. A probe that does not answer within
+        `probe_timeout` seconds counts as a failure. When an endpoint is declared
+        dead, `on_endpoint_dead` (if provided) is called with the endpoint.
+
+        Whenever the status of an instance changes, `on_status_change` (if provided)
+        is called with its endpoint, identifier and new status.
+
+        Endpoints added while the backend could not connect to them are probed
+        by trying to connect again, and once that succeeds `on_endpoint_reconnected`
+        (if provided) is called with the endpoint.
+
+        Whenever an endpoint becomes alive again, `on_endpoint_alive` (if provided)
+        is called with the endpoint.
         """
         Thread.__init__(self)
         self.o_queue = Queue()
-        self.clients = connections.copy()
-        self.clients_lock = Lock()
+        self.backend = backend
+        self.endpoints_lock = Lock()
         self.watch_for_list = []
         self.watch_for_lock = Lock()
         self.running = False
         self.last_known = {}
+        # Endpoint liveness tracking
+        self.suspect_threshold = suspect_threshold
+        self.dead_threshold = dead_threshold
+        self.probe_timeout = probe_timeout
+        self.on_endpoint_dead = on_endpoint_dead
+        self.on_status_change = on_status_change
+        self.on_endpoint_reconnected = on_endpoint_reconnected
+        self.on_endpoint_alive = on_endpoint_alive
+        self.endpoint_failures = {}
+        self.endpoint_state = {}
+        self.pending_probes = {}
+        # Endpoints the backend is not connected to yet
+        self.reconnecting = set()
         self.logger = logging.getLogger("mettaton.nurse")
         self.logger.info("Built nurse healthchecker")
 
@@ -53,31 +82,54 @@ class HealthChecker(Thread):
         """
         return self.o_queue
 
-    def add_connection(self, endpoint: str, client: docker.DockerClient):
+    def add_connection(self, endpoint: str, connected: bool = True):
         """
-        Add a connection to a Docker daemon, given the provided `endpoint` (str)
-        and `DockerClient` client object.
+        Start checking the provided `endpoint` (str), which the backend
+        is connected to. If it is not, the endpoint starts out suspect and
+        its probes try to connect to it, until it either answers or is
+        declared dead.
         """
-        self.clients_lock.acquire()
-        self.clients[endpoint] = client
-        self.clients_lock.release()
-        self.logger.info("Added connection to %s", endpoint)
+        self.endpoints_lock.acquire()
+        if connected:
+            self.endpoint_failures[endpoint] = 0
+            self.endpoint_state[endpoint] = "HOST_ALIVE"
+            self.reconnecting.discard(endpoint)
+        else:
+            self.endpoint_failures[endpoint] = self.suspect_threshold
+            self.endpoint_state[endpoint] = "HOST_SUSPECT"
+            self.reconnecting.add(endpoint)
+        self.endpoints_lock.release()
+        self.logger.info("Added %s to %s", "connection" if connected else "reconnection", endpoint)
+
+    def get_reconnecting(self) -> list:
+        """
+        Return the endpoints the backend is not connected to yet, but which
+        are not declared dead either.
+        """
+        with self.endpoints_lock:
+            return list(self.reconnecting)
+
+    def _reconnect(self, endpoint: str) -> bool:
+        """Probe of an endpoint we are not connected to: connect, then ping"""
+        self.backend.connect(endpoint)
+        return self.backend.ping(endpoint)
 
     def disconnect(self, endpoint: str):
         """
         Disconnect from the provided endpoint.
         """
-        self.clients_lock.acquire()
-        try:
-            del self.clients[endpoint]
-        except KeyError:
+        self.endpoints_lock.acquire()
+        if self.endpoint_state.pop(endpoint, None) is None:
             self.logger.warning("HealthChecker did not have a connection to %s", endpoint)
-        self.clients_lock.release()
+        self.endpoint_failures.pop(endpoint, None)
+        self.pending_probes.pop(endpoint, None)
+        self.reconnecting.discard(endpoint)
+        self.endpoints_lock.release()
         self.logger.info("Disconnected from %s", endpoint)
 
     def watch_for(self, endpoint: str, ident: str) -> bool:
         """
-        Add references to a container at `endpoint` with ID `ident` which state
+        Add references to an instance at `endpoint` with ID `ident` which state
         needs to be watched.
         Returns True if all went well.
         """
@@ -90,23 +142,64 @@ class HealthChecker(Thread):
 
     def unwatch_for(self, endpoint: str, ident: str) -> bool:
         """
-        Tells the Health Checker to stop watching for the container `ident` at endpoint `endpoint`.
-        Returns True if all went well, False if the specified container was not being watched.
+        Tells the Health Checker to stop watching for the instance `ident` at endpoint `endpoint`.
+        Returns True if all went well, False if the specified instance was not being watched.
         """
         self.watch_for_lock.acquire()
         if not (endpoint, ident) in self.watch_for_list:
+            self.watch_for_lock.release()
             return False
         self.logger.info("No longer watching for %s / %s", endpoint, ident)
         self.watch_for_list.remove((endpoint, ident))
+        self.last_known.pop((endpoint, ident), None)
         self.watch_for_lock.release()
         return True
 
+    def unwatch_many(self, watches: list):
+        """
+        Tells the Health Checker to stop watching for several `(endpoint, ident)`
+        instances at once.
+        """
+        watches = set(watches)
+        with self.watch_for_lock:
+            self.watch_for_list = [watch for watch in self.watch_for_list if not watch in watches]
+            for watch in watches:
+                self.last_known.pop(watch, None)
+        self.logger.info("No longer watching for %d instances", len(watches))
+
+    def _submit_probe(self, probe, endpoint: str) -> Future:
+        """
+        Run `probe(endpoint)` in a thread of its own, so that a hung probe
+        never delays those of other endpoints. Returns its future.
+        """
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(probe(endpoint))
+            except BaseException as error:
+                future.set_exception(error)
+
+        Thread(target=run, name="mettaton-probe", daemon=True).start()
+        return future
+
+    def get_endpoint_state(self, endpoint: str) -> str:
+        """
+        Return the liveness state of `endpoint` as last determined by the probes:
+        "HOST_ALIVE", "HOST_SUSPECT" or "HOST_DEAD". "UNKNOWN" is returned for
+        endpoints the Health Checker is not connected to.
+        """
+        with self.endpoints_lock:
+            return self.endpoint_state.get(endpoint, "UNKNOWN")
+
     def start(self):
         """
         Start the Health Checker thread.
         """
-        Thread.start(self)
         self.running = True
+        Thread.start(self)
 
     def stop(self):
         """
@@ -114,69 +207,143 @@ class HealthChecker(Thread):
         """
         self.running = False
 
-    def check_container(self, endpoint: str, ident: str):
+    def check_instances(self, endpoint: str, idents: list):
         """
-        Internal method used by the Health Checker to check for the health of a specific
-        container at `endpoint` with identifier `ident`. The health status is obtained from
-        the attributes of the retrieved container object, which contains a key
-        ['State']['Health']['Status'].
+        Internal method used by the Health Checker to check for the health of the
+        instances `idents` at `endpoint`, with a single call to the backend.
 
-        The values can be "starting", "healthy", "unhealthy", and so on. "UNKNOWN" is another state
-        that can be returned when the health checker loses an endpoint. "NOT_FOUND" is a similar state
-        that does not exist within docker but is returned when the health checker still has the
-        associated endpoint for a container, but cannot find it there anymore.
+        The values can be "starting", "healthy", "unhealthy", and so on, depending on the
+        backend. "UNKNOWN" is another state that can be returned when the health checker
+        loses an endpoint, or does not trust it. "NOT_FOUND" is a similar state that is
+        returned when the health checker still has the associated endpoint for an instance,
+        but cannot find it there anymore.
 
-        Updates are only sent when the state of a container changes.
+        Updates are only sent when the state of an instance changes.
 
         The status retrieved here is shoved into the event queue as the second element of a tuple
-        which first element is the combination `(endpoint, ident)` describing the container.
-        """
-        container = None
-        self.clients_lock.acquire()
-        conn = self.clients.get(endpoint)
-        watch = (endpoint, ident)
-        if conn is None and self.last_known[watch]:
-            self.last_known[watch] = "UNKNOWN"
-            self.o_queue.put((watch, "UNKNOWN"))
-            self.clients_lock.release()
-            return
-
-        # With the connection we have, try and
-        # Get the container
-        try:
-            container = conn.containers.get(ident)
-        except NotFound:
-            container = None
-
-        # Potentially raise an alert
-        if container is None:
-            if self.last_known.get(ident, "UNKNOWN") != "NOT_FOUND":
-                self.last_known[ident] = "NOT_FOUND"
-                self.o_queue.put((ident, "NOT_FOUND"))
-            self.clients_lock.release()
-            return
-
-        status = container.attrs['State']['Health']['Status']
-        if self.last_known.get(ident, "UNKNOWN") != status:
-            self.last_known[ident] = status
-            self.o_queue.put((ident, status))
-        self.clients_lock.release()
+        which first element is the combination `(endpoint, ident)` describing the instance.
+        """
+        if self.get_endpoint_state(endpoint) != "HOST_ALIVE":
+            # Either the endpoint is gone or we cannot trust it right now
+            statuses = dict.fromkeys(idents, "UNKNOWN")
+        else:
+            statuses = self.backend.health(endpoint, idents)
+
+        with self.watch_for_lock:
+            watched = set(self.watch_for_list)
+            for ident, status in statuses.items():
+                watch = (endpoint, ident)
+                if not watch in watched:
+                    # No longer watched since we copied the list
+                    continue
+                if self.last_known.get(watch, "UNKNOWN") != status:
+                    self.last_known[watch] = status
+                    self.o_queue.put((watch, status))
+                    if self.on_status_change is not None:
+                        self.on_status_change(endpoint, ident, status)
+
+    def check_endpoints(self):
+        """
+        Internal method used by the Health Checker to probe the liveness of every
+        endpoint it is connected to. Probes are cheap `ping()` calls to the backend, every
+        endpoint having at most one in flight in its own thread. They are all awaited
+        together for at most `probe_timeout` seconds, and a probe still pending
+        then counts as a failure.
+
+        State transitions are shoved into the event queue as a tuple
+        `(endpoint, state)` where the state is one of "HOST_ALIVE", "HOST_SUSPECT"
+        and "HOST_DEAD". Dead endpoints are no longer probed, and are handed over
+        to the `on_endpoint_dead` callback.
+        """
+        self.endpoints_lock.acquire()
+        probes = {}
+        for endpoint, state in self.endpoint_state.items():
+            if state == "HOST_DEAD":
+                continue
+            pending = self.pending_probes.get(endpoint)
+            if pending is None or pending.done():
+                probe = self._reconnect if endpoint in self.reconnecting else self.backend.ping
+                pending = self._submit_probe(probe, endpoint)
+                self.pending_probes[endpoint] = pending
+            probes[endpoint] = pending
+        self.endpoints_lock.release()
+
+        if len(probes) > 0:
+            wait(probes.values(), timeout=self.probe_timeout)
+
+        dead = []
+        reconnected = []
+        revived = []
+        for endpoint, probe in probes.items():
+            if not probe.done():
+                # Still hanging
+                alive = False
+            elif probe.exception() is not None:
+                self.logger.debug("Probe of %s failed: %s", endpoint, probe.exception())
+                alive = False
+            else:
+                alive = bool(probe.result())
+
+            with self.endpoints_lock:
+                if endpoint not in self.endpoint_state:
+                    # Disconnected while we were probing
+                    continue
+                previous = self.endpoint_state.get(endpoint, "HOST_ALIVE")
+                if alive:
+                    self.endpoint_failures[endpoint] = 0
+                    state = "HOST_ALIVE"
+                    if endpoint in self.reconnecting:
+                        self.reconnecting.discard(endpoint)
+                        reconnected.append(endpoint)
+                else:
+                    failures = self.endpoint_failures.get(endpoint, 0) + 1
+                    self.endpoint_failures[endpoint] = failures
+                    state = previous
+                    if failures >= self.dead_threshold:
+                        state = "HOST_DEAD"
+                    elif failures >= self.suspect_threshold:
+                        state = "HOST_SUSPECT"
+                if state == previous:
+                    continue
+                self.endpoint_state[endpoint] = state
+            self.logger.warning("Endpoint %s is now %s", endpoint, state)
+            self.o_queue.put((endpoint, state))
+            if state == "HOST_DEAD":
+                dead.append(endpoint)
+            elif state == "HOST_ALIVE":
+                revived.append(endpoint)
+
+        if self.on_endpoint_reconnected is not None:
+            for endpoint in reconnected:
+                self.on_endpoint_reconnected(endpoint)
+        if self.on_endpoint_alive is not None:
+            for endpoint in revived:
+                self.on_endpoint_alive(endpoint)
+        if self.on_endpoint_dead is not None:
+            for endpoint in dead:
+                self.on_endpoint_dead(endpoint)
 
     def run(self):
         """
         Mail loop.
 
-        Handles triggering the check for every watched container.
+        Handles triggering the check for every watched instance, grouped by endpoint.
         If the check cycle takes longer than a full second, do not wait.
         Otherwise, wait until a full second has elapsed since the loop began.
         """
         self.logger.info("Health check loop begins")
         while self.running:
             now = time.time()
-            self.watch_for_lock.acquire()
-            for (endpoint, ident) in self.watch_for_list:
-                self.check_container(endpoint, ident)
-            self.watch_for_lock.release()
+            self.check_endpoints()
+            by_endpoint = {}
+            with self.watch_for_lock:
+                for (endpoint, ident) in self.watch_for_list:
+                    by_endpoint.setdefault(endpoint, []).append(ident)
+            for endpoint, idents in by_endpoint.items():
+                if not self.running:
+                    # Do not finish the sweep when asked to stop
+                    break
+                self.check_instances(endpoint, idents)
             cycle = time.time() - now
             time.sleep(0 if cycle > 1 else 1 - cycle)
         self.shutdown()
@@ -1,58 +1,126 @@
-"""Persistence module"""
+"""Persistence module
+
+The state is stored as JSON lines. The first line is a header holding the
+schema version and the list of servers, every following line describes one
+instance with everything needed to recreate it:
+
+    {"version":2,"servers":["unix:///var/run/docker.sock"]}
+    {"id":"...","host":"...","image":"...","name":"...","environment":{},"port_config":{},"created":1700000000.0}
+
+Files written by older versions (a single JSON object without a version)
+are migrated when loaded.
+"""
 
 import json
 import logging
 import os
-
-from docker.errors import NotFound
+import tempfile
 
 from .errors import SaveStateParseError
 
 log = logging.getLogger('mettaton.persistence')
 
-def save_state(path: str, meta: "Mettaton"):
+# Current version of the state schema
+STATE_VERSION = 2
+
+# Fields of an instance record, besides its identifier
+RECORD_FIELDS = ("host", "image", "name", "environment", "port_config", "created")
+
+def _encode(obj) -> str:
+    """Compact JSON encoding of a single line"""
+    return json.dumps(obj, separators=(",", ":"))
+
+def save_state(path: str, servers: list, instances: dict):
     """
-    Save the state of the provided `Mettaton` object to a file
-    which path is provided as first argument.
+    Save a state to a file which path is provided as first argument.
+    `servers` is the list of endpoints we are connected to, and `instances`
+    maps instance identifiers to their record (see `RECORD_FIELDS`).
+    The file is written to a unique temporary file next to its destination
+    then moved in place, so that a crash never leaves a truncated state behind.
+    Concurrent writers must still be serialized by the caller, or an older
+    state may land last.
     """
     # TODO: Check filesystem
+    lines = [_encode({"version": STATE_VERSION, "servers": list(servers)})]
+    for ident, record in instances.items():
+        line = {"id": ident}
+        line.update(record)
+        lines.append(_encode(line))
 
-    with open(path, "w") as fptr:
-        dct_data = {}
-        dct_data['servers'] = list(meta.clients.keys())
-        dct_data['instances'] = {k: h for (k, (h, _)) in meta.instances.items()}
-        json.dump(dct_data, fptr)
+    directory, filename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=filename + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as fptr:
+            fptr.write("\n".join(lines))
+            fptr.write("\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _migrate_legacy(dct_data: dict) -> dict:
+    """
+    Convert a version-less state, `{"servers": [...], "instances": {id: host}}`
+    with an optional `"specs"` dictionary, to the current format.
+    Instances without a known specification keep `None` fields.
+    """
+    log.info("Migrating legacy state to version %d", STATE_VERSION)
+    specs = dct_data.get("specs", {})
+    instances = {}
+    for ident, host in dct_data.get("instances", {}).items():
+        record = dict.fromkeys(RECORD_FIELDS)
+        record.update(specs.get(ident, {}))
+        record["host"] = host
+        instances[ident] = record
+    return {
+        "version": STATE_VERSION,
+        "servers": dct_data.get("servers", []),
+        "instances": instances
+    }
 
-def load_state(path: str, meta: "Mettaton") -> bool:
+def load_state(path: str) -> dict:
     """
-    Load a state for the manager object from a given file path
+    Load a state from a given file path, without contacting any daemon.
+    Returns a dictionary with the keys `version`, `servers` and `instances`,
+    the latter mapping instance identifiers to their record.
     """
 
     with open(path, "r") as fptr:
+        content = fptr.read()
+
+    lines = content.splitlines()
+    try:
+        header = json.loads(lines[0]) if lines else None
+    except json.decoder.JSONDecodeError:
+        # Legacy states may be pretty-printed over several lines
+        header = None
+    if header is None or not "version" in header:
         try:
-            dct_data = json.load(fptr)
-        except json.decoder.JSONDecodeError:
-            raise SaveStateParseError()
-    return dct_data
-
-    meta.build_connections(dct_data['servers'])
-    meta.instances_lock.acquire()
-    for key, host in dct_data['instances'].items():
-        if not host in meta.clients:
-            log.error("Host %s for instance %s is not connected. Instance is lost.", host, key)
+            return _migrate_legacy(json.loads(content))
+        except (json.decoder.JSONDecodeError, AttributeError):
+            raise SaveStateParseError() from None
+
+    if header["version"] > STATE_VERSION:
+        raise SaveStateParseError("Unsupported state version {}".format(header["version"]))
+
+    instances = {}
+    for line in lines[1:]:
+        if not line:
             continue
-        conn = meta.clients[host]
-        container = None
         try:
-            container = conn.containers.get(key)
-        except NotFound as error:
-            log.error("ERROR: Server %s in persistence no longer found in docker daemon", key)
-        if container is not None:
-            meta.instances[key] = (host, container)
-        # TODO don't fail silently
-
-    meta.instances_lock.release()
-    return True
+            record = json.loads(line)
+            ident = record.pop("id")
+        except (json.decoder.JSONDecodeError, KeyError):
+            raise SaveStateParseError("Invalid instance record: {}".format(line)) from None
+        instances[ident] = {field: record.get(field) for field in RECORD_FIELDS}
+    return {
+        "version": header["version"],
+        "servers": header.get("servers", []),
+        "instances": instances
+    }
 
 def discard_state(path: str):
     """
@@ -0,0 +1,149 @@
+"""
+Idle Reaper Mechanism
+Module containing logic to find and reclaim the instances nobody plays on
+"""
+
+import logging  # logging library
+import time     # To date the last activity of instances
+
+from .utils import *    # Various utilities
+from .errors import *   # All of our error types
+from .backends import Backend
+
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
+
+class Reaper(Thread):
+    """
+    The Reaper is the thread that runs alongside a Mettaton object in order
+    to stop the game servers that have been idle for too long
+    """
+    def __init__(self, backend: Backend, fleet, on_idle,
+            timeout: float = 1800.0, interval: float = 60.0,
+            min_bytes: int = 4096, min_log_lines: int = 1,
+            checkpoint: str = None, batch_size: int = 16):
+        """
+        The reaper looks at the instances of `fleet` every `interval` seconds,
+        and collects their activity counters from `backend`. An instance is
+        active during an interval if it exchanged at least `min_bytes` on the
+        network, or wrote at least `min_log_lines` lines of logs.
+
+        Instances that have not been active for `timeout` seconds are handed
+        over to `on_idle` in lists of at most `batch_size` `(endpoint, ident)`
+        tuples. If `checkpoint` is set to a repository, every idle instance is
+        first committed to an image of that repository tagged with its name,
+        and instances that could not be committed are kept.
+
+        Instances for which the backend reports no activity counters are
+        never considered idle.
+        """
+        Thread.__init__(self, name="mettaton-reaper", daemon=True)
+        self.backend = backend
+        self.fleet = fleet
+        self.on_idle = on_idle
+        self.timeout = timeout
+        self.interval = interval
+        self.min_bytes = min_bytes
+        self.min_log_lines = min_log_lines
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        # Last network counter and time of last activity of every instance
+        self.activity = {}
+        self.last_sweep = time.time()
+        self.stopped = Event()
+        self.logger = logging.getLogger("mettaton.reaper")
+        self.logger.info("Built idle reaper")
+
+    def stop(self):
+        """
+        Stop the Reaper thread.
+        """
+        self.stopped.set()
+
+    def find_idle(self) -> list:
+        """
+        Collect the activity of every instance, one backend call per endpoint
+        run in parallel, and return the `(endpoint, ident)` of those that have
+        been idle for longer than the timeout.
+        """
+        now = time.time()
+        by_endpoint = {}
+        for record in self.fleet.snapshot():
+            by_endpoint.setdefault(record.host, []).append(record.ident)
+
+        # Forget about the instances that are gone
+        known = {ident for idents in by_endpoint.values() for ident in idents}
+        for ident in [ident for ident in self.activity if not ident in known]:
+            del self.activity[ident]
+
+        idle = []
+        with ThreadPoolExecutor(max_workers=max(1, len(by_endpoint))) as pool:
+            futures = {endpoint: pool.submit(self.backend.activity, endpoint, idents, self.last_sweep)
+                    for endpoint, idents in by_endpoint.items()}
+            for endpoint, future in futures.items():
+                try:
+                    counters = future.result()
+                except RuntimeError as error:
+                    # The nurse will decide whether the host is gone
+                    self.logger.warning("Could not collect the activity on %s: %s", endpoint, error)
+                    continue
+                for ident, (network, log_lines) in counters.items():
+                    previous = self.activity.get(ident)
+                    if previous is None:
+                        # No delta yet, start counting from now
+                        last_active = now
+                    else:
+                        last_network, last_active = previous
+                        # A counter going down means the instance restarted
+                        delta = network - last_network
+                        if delta < 0 or delta >= self.min_bytes or log_lines >= self.min_log_lines:
+                            last_active = now
+                    self.activity[ident] = (network, last_active)
+                    if now - last_active >= self.timeout:
+                        idle.append((endpoint, ident))
+        self.last_sweep = now
+        return idle
+
+    def _checkpoint(self, idle: list) -> list:
+        """Commit every idle instance, and return those that were committed"""
+        committed = []
+        for endpoint, ident in idle:
+            record = self.fleet.get(ident)
+            tag = record.name if record is not None and record.name else ident
+            try:
+                image = self.backend.checkpoint(endpoint, ident, self.checkpoint, tag)
+            except (RuntimeError, NotImplementedError) as error:
+                self.logger.error("Could not checkpoint %s on %s, keeping it: %s", ident, endpoint, error)
+                continue
+            self.logger.info("Checkpointed %s on %s as %s:%s (%s)", ident, endpoint, self.checkpoint, tag, image)
+            committed.append((endpoint, ident))
+        return committed
+
+    def sweep(self):
+        """
+        Find the idle instances, checkpoint them if required, and hand them
+        over to `on_idle` in batches.
+        """
+        idle = self.find_idle()
+        if len(idle) == 0:
+            return
+        self.logger.info("Found %d idle instances", len(idle))
+        if self.checkpoint is not None:
+            idle = self._checkpoint(idle)
+        for start in range(0, len(idle), self.batch_size):
+            batch = idle[start:start + self.batch_size]
+            self.on_idle(batch)
+            for (_, ident) in batch:
+                self.activity.pop(ident, None)
+
+    def run(self):
+        """
+        Main loop. Sweeps every `interval` seconds until stopped.
+        """
+        self.logger.info("Idle reaper loop begins")
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as error:
+                self.logger.error("Idle sweep failed: %s", error)
+        self.logger.info("Idle reaper loop ends")
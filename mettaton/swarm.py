@@ -0,0 +1,288 @@
+"""
+Mettaton, the simple wrapper around the Python Docker
+Library's Engine for Game Server Cluster Management
+"""
+# Errors from docker's library
+from docker.errors import APIError
+
+from .utils import *   # Various utilities
+from .persistence import discard_state
+from .core import Orchestrator
+from .backends.swarm import SwarmBackend, LOCAL_ENDPOINT
+
+import bisect
+from threading import Lock
+
+class MettatonSwarm(Orchestrator):
+    """Mettaton, the friendly(?) server deployment manager"""
+    def __init__(self, cluster_config = {}, nfp = 5000, storage_path="/tmp/mettaton.state",
+            launch_workers = 8, backend = None):
+        """Initialize a Mettaton client.
+        This will not perform the connection to the local docker
+        client automatically. This is your own responsability to
+        do with Mettaton.connect
+
+        Batched launches create up to `launch_workers` services in parallel.
+        The swarm reschedules tasks by itself, so failover is disabled.
+        The previous state is only loaded by `regain_cluster`.
+        """
+        # Protects the port allocation
+        self.lock = Lock()
+
+        # Client object to Docker Daemon
+        self.client = None
+
+        # Node identifier returned when creating/connecting
+        # To the swarm
+        self.raw_object = None
+
+        # A list of gaps in the list of ports available
+        self.available_ports = []
+
+        # The next known free port after which none are taken
+        self.next_free_port = nfp
+
+        # Ports above this one are managed by our allocator, those below
+        # can only be given explicitly and are never handed out again
+        self.first_managed_port = nfp
+
+        # Maximum number of parallel service creations
+        self.launch_workers = launch_workers
+
+        # Worker token to add servers to the swarm
+        self.worker_token = None
+
+        # The configuration for the cluster
+        self.config = cluster_config
+
+        Orchestrator.__init__(self, backend or SwarmBackend(),
+                storage_path = storage_path,
+                failover = False,
+                restore = False)
+
+    def __del__(self):
+        # Leaving the swarm is never implicit
+        with self.valid_lock:
+            valid = self.valid
+            self.valid = False
+        if valid:
+            self._stop_nurse()
+
+    def is_connected(self):
+        """Is the manager connected?"""
+        return LOCAL_ENDPOINT in self.backend.endpoints()
+
+    def connect(self):
+        """Connect mettaton to the local environment docker client"""
+        # TODO: Change this to have explicit errors
+        self.build_connections([LOCAL_ENDPOINT])
+        self.client = self.backend.client(LOCAL_ENDPOINT)
+        self.logger.info("Connected to Docker Daemon")
+        # TODO: This could fail, figure out all the ways it could
+        # and report them
+
+    def start_new_cluster(self):
+        """Start the Mettaton cluster, yielding the key that lets you connected to it"""
+        self.logger.debug("Initializing cluster...")
+        try:
+            self.client.swarm.init(**self.config)
+        except APIError as e:
+            raise produce_appropriate_exception(e)
+
+        self._update_post_join_info()
+        self.logger.info("Initialized cluster successfully: %s", self.raw_object.get('ID'))
+        self.save_state()
+
+    def _restore(self, state):
+        """Restore the instances of a loaded `state` and the ports they publish"""
+        Orchestrator._restore(self, state)
+        with self.instances_lock:
+            published = [port for spec in self.specs.values()
+                    for port in spec["port_config"].values()]
+        with self.lock:
+            for port in published:
+                self._reserve_port(int(port))
+
+    def regain_cluster(self):
+        """Regain control over an existing cluster"""
+        self.logger.info("Reloading cluster information...")
+        try:
+            self.client.swarm.reload()
+        except APIError as error:
+            raise produce_appropriate_exception(error)
+        self._update_post_join_info()
+        self.logger.info("Regained cluster successfully (swam id %s)", self.raw_object.get('ID'))
+        self.load_state()
+
+    def _update_post_join_info(self):
+        """Update and display vital information after successfully
+        connecting to/creating a swarm"""
+        self.raw_object = self.client.swarm.attrs
+        self.worker_token = self.raw_object.get("JoinTokens", {}).get("Worker")
+        self.logger.info("Worker join token is " + str(self.worker_token))
+
+    def shutdown(self, force=False):
+        if not self.is_connected():
+            raise RuntimeError("Not running")
+        if not self.raw_object:
+            raise RuntimeError("Cluster Not Started")
+        ret_status = self.client.swarm.leave(force=force)
+        if ret_status:
+            self.logger.info("Successfully left the cluster")
+        else:
+            self.logger.error("Failure to leave the cluster")
+
+        # Destroy on-disk state
+        try:
+            discard_state(self.storage_path)
+        except IOError:
+            self.logger.error("I/O error during state removal")
+        except FileNotFoundError:
+            pass
+        else:
+            self.logger.info("Successfully destroyed stale state")
+
+        self._stop_nurse()
+        self.backend.disconnect(LOCAL_ENDPOINT)
+        with self.valid_lock:
+            self.valid = False
+        return ret_status
+
+    def get_worker_token(self):
+        """Return the worker token needed by servers to join the cluster"""
+        return self.worker_token
+
+    def _find_next_free_port(self):
+        """Obtain the next free port in our range"""
+        if len(self.available_ports) == 0:
+            self.next_free_port += 1
+            return self.next_free_port
+        port = self.available_ports.pop(0)
+        return port
+
+    def _reserve_port(self, port):
+        """
+        Mark `port` as used, extending the range if it lies beyond it.
+        Returns whether the port was taken from the pool, which is not the
+        case for ports outside of the managed range or already in use.
+        """
+        if port <= self.first_managed_port:
+            # Outside of the managed range
+            return False
+        if port in self.available_ports:
+            self.available_ports.remove(port)
+        elif port > self.next_free_port:
+            # Everything we skip over becomes a gap
+            for gap in range(self.next_free_port + 1, port):
+                bisect.insort(self.available_ports, gap)
+            self.next_free_port = port
+        else:
+            return False
+        return True
+
+    def _release_port(self, port):
+        """Give `port` back to the pool of available ports, if we manage it"""
+        if port <= self.first_managed_port:
+            return
+        if port == self.next_free_port:
+            self.next_free_port -= 1
+            # Gaps right below the top of the range are no longer gaps
+            while self.available_ports and self.available_ports[-1] == self.next_free_port:
+                self.available_ports.pop()
+                self.next_free_port -= 1
+        elif not port in self.available_ports:
+            bisect.insort(self.available_ports, port)
+
+    def _prepare_launch(self, image, exposition_port = 80,
+            server = None, port = None,
+            **kwargs):
+        """
+        Reserve a port for a new server, and build the arguments of its
+        `start_server` launch. Returns them along with whether the port was
+        taken from the pool, and must then be released if the launch fails.
+        Must be called with the lock held.
+        """
+        # TODO: Check validity of arguments
+
+        # Published in host mode on a port we either generate
+        # or we are given
+        if port is None:
+            # Assign the next free port by default
+            port = self._find_next_free_port()
+            taken = True
+        else:
+            # Just in case someone wants to be a trickster and sends us
+            # a port that is not a string but parses as an int
+            port = int(port)
+            # No, I will not catch the resulting exception. If someone
+            # does garbage with this module they might as well own up
+            # to it
+            taken = self._reserve_port(port)
+
+        # If we are given a host, constraint ourselves to it
+        if server is not None:
+            kwargs["constraints"] = ["node.ip=={}".format(server)]
+
+        return taken, {
+            "image": image,
+            "name": "server-" + generate_identifier(),
+            "environment": kwargs.pop("env", {}),
+            "port_config": {"{}/tcp".format(int(exposition_port)): port},
+            "host": LOCAL_ENDPOINT,
+            "options": kwargs
+        }
+
+    def launch_server(self, image, exposition_port = 80,
+            server = None, port = None,
+            **kwargs):
+        """
+        Deploy a server somewhere in the cluster.
+        Returns its identifier and the port it is published on.
+        """
+        result = self.launch_servers([{"image": image, "exposition_port": exposition_port,
+            "server": server, "port": port, **kwargs}])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def launch_servers(self, launches):
+        """
+        Deploy several servers at once. `launches` is a list of dictionaries
+        holding the arguments of `launch_server`. Services are created in
+        parallel and the state is saved once.
+
+        Returns a list with, for every launch in order, either the identifier and
+        port of the server, or the exception that prevented its creation.
+        """
+        with self.lock:
+            prepared = [self._prepare_launch(**launch) for launch in launches]
+
+        results = []
+        started = self.start_servers([launch for (_, launch) in prepared], workers=self.launch_workers)
+        for (taken, launch), result in zip(prepared, started):
+            port = list(launch["port_config"].values())[0]
+            if isinstance(result, Exception):
+                # Only give back what this launch took
+                if taken:
+                    with self.lock:
+                        self._release_port(port)
+                results.append(result)
+            else:
+                results.append((result[1], port))
+        return results
+
+    def stop_server(self, identifier):
+        """Remove the service of server `identifier` and release its port"""
+        with self.instances_lock:
+            spec = self.specs.get(identifier, {})
+        self.shutdown_server(identifier)
+        with self.lock:
+            for port in spec.get("port_config", {}).values():
+                self._release_port(int(port))
+
+    def list_services(self):
+        """
+        List the identifiers of the services managed by Mettaton in the
+        swarm with a single filtered query.
+        """
+        return self.backend.list_services(LOCAL_ENDPOINT)
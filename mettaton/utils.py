@@ -1,24 +1,97 @@
 """Utilities module"""
 
+import re
 from os import urandom
 from hashlib import sha256
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
 from .errors import *
 
-def produce_appropriate_exception(exc):
-    string_representation = str(exc)
-    if "Permission denied" in string_representation:
-        return RuntimeError("Permission denied to access docker daemon")
-    if "This node is not a swarm manager" in string_representation:
-        return RuntimeError("Server is not manager of any node")
-    if "name must be valid as a DNS name component" in string_representation:
-        return RuntimeError("Generated ID somehow invalid domain name")
-    if "to be able to reuse that name." in string_representation:
-        return ContainerNameAlreadyInuse(exc)
-    if "SSL: WRONG_VERSION_NUMBER" in string_representation:
-        return DockerConnectSSLWrongVersionNumber(exc)
-    if "port is already allocated" in string_representation:
-        return DockerNetworkPortAlreadyAllocated(exc)
-    return RuntimeError(string_representation)
+# Known error messages, by decreasing priority, along with the error they
+# translate to and the message to use instead of the original one, if any
+KNOWN_ERRORS = (
+    ("ssl", r"SSL: WRONG_VERSION_NUMBER", DockerConnectSSLWrongVersionNumber, None),
+    ("permission", r"Permission denied", MettatonError, "Permission denied to access docker daemon"),
+    ("manager", r"This node is not a swarm manager", MettatonError, "Server is not manager of any node"),
+    ("dns", r"name must be valid as a DNS name component", MettatonError, "Generated ID somehow invalid domain name"),
+    ("name", r"to be able to reuse that name\.|name conflicts with an existing object", ContainerNameAlreadyInuse, None),
+    ("port", r"(?::(?P<port_number>\d+) failed: )?port is already allocated", DockerNetworkPortAlreadyAllocated, None),
+    ("image", r"No such image|pull access denied|manifest unknown", ImageNotFound, None),
+    ("container", r"No such (?:container|service|task)|(?:service|task) \S+ not found", NoSuchInstance, None),
+    ("daemon", r"Connection refused|Connection aborted|Cannot connect to the Docker daemon|Error while fetching server API version",
+        DaemonUnavailable, None),
+)
+KNOWN_ERRORS_RE = re.compile("|".join("(?P<{}>{})".format(name, pattern)
+    for (name, pattern, _, _) in KNOWN_ERRORS))
+
+# A 404 about one of these is about an instance, other objects (networks,
+# volumes, nodes...) are not
+INSTANCE_OBJECTS_RE = re.compile(r"\b(?:containers?|services?|tasks?)\b", re.IGNORECASE)
+
+def produce_appropriate_exception(exc, host=None, instance=None):
+    """
+    Translate an exception raised by the Docker library into one of our
+    error types, carrying `host` and `instance` along with any port found
+    in the error.
+
+    Messages are matched against every known error in a single pass, and the
+    match with the highest priority wins. API errors that match none of them
+    are classified from their HTTP status code: a 404 about a container,
+    service or task means the instance is gone, a 409 is a conflict, a 503
+    means the daemon is unavailable and other 5xx codes are daemon errors.
+    Connection failures and timeouts make the daemon unavailable.
+    """
+    status_code = getattr(exc, "status_code", None)
+    message = getattr(exc, "explanation", None) or str(exc)
+
+    found = {}
+    for match in KNOWN_ERRORS_RE.finditer(message):
+        found.setdefault(match.lastgroup, match)
+
+    for (name, _, error_type, replacement) in KNOWN_ERRORS:
+        match = found.get(name)
+        if match is None:
+            continue
+        port = match.group("port_number") if name == "port" else None
+        return error_type(replacement or message, host=host, instance=instance,
+                port=int(port) if port else None)
+
+    if status_code == 404 and INSTANCE_OBJECTS_RE.search(message):
+        return NoSuchInstance(message, host=host, instance=instance)
+    if status_code == 409:
+        return InstanceConflict(message, host=host, instance=instance)
+    if status_code == 503:
+        return DaemonUnavailable(message, host=host, instance=instance)
+    if status_code is not None and status_code >= 500:
+        return DaemonError(message, host=host, instance=instance)
+    if status_code is None and isinstance(exc, (ConnectionError, TimeoutError,
+            RequestsConnectionError, RequestsTimeout)):
+        return DaemonUnavailable(message, host=host, instance=instance)
+    return MettatonError(message, host=host, instance=instance)
+
+def host_ports(binding) -> list:
+    """
+    Return the host ports of a port binding as accepted by the Docker library:
+    a port, an `(address, port)` tuple, a list of those, or `None` when the
+    daemon picks the port itself.
+    """
+    if binding is None:
+        return []
+    if isinstance(binding, list):
+        return [port for item in binding for port in host_ports(item)]
+    if isinstance(binding, tuple):
+        return host_ports(binding[1]) if len(binding) > 1 else []
+    return [int(binding)]
+
+def port_bindings(port_config) -> set:
+    """
+    Return the host ports published by a port configuration such as
+    `{"25565/tcp": 25569}`, as a set of `(port, protocol)`.
+    """
+    bindings = set()
+    for internal, binding in (port_config or {}).items():
+        protocol = str(internal).partition("/")[2] or "tcp"
+        bindings.update((port, protocol) for port in host_ports(binding))
+    return bindings
 
 def generate_identifier():
     """Generate a random identifier for servers"""
@@ -0,0 +1,48 @@
+"""Shared fixtures, every test runs against the in-memory backend"""
+
+import time
+
+import pytest
+
+from mettaton import Mettaton, MemoryBackend
+
+def wait_for(predicate, timeout=10.0):
+    """Poll `predicate` until it holds, failing after `timeout` seconds"""
+    end = time.time() + timeout
+    while time.time() < end:
+        if predicate():
+            return
+        time.sleep(0.05)
+    raise AssertionError("Condition not met within {}s".format(timeout))
+
+def drain_events(queue):
+    """Return every event currently posted to `queue`"""
+    events = []
+    while not queue.empty():
+        events.append(queue.get())
+    return events
+
+@pytest.fixture
+def backend():
+    return MemoryBackend()
+
+@pytest.fixture
+def storage_path(tmp_path):
+    return str(tmp_path / "mettaton.state")
+
+@pytest.fixture
+def make_manager(backend, storage_path):
+    """Build managers over the shared backend, and shut them all down afterwards"""
+    managers = []
+
+    def make(servers=("host-1", "host-2"), **kwargs):
+        kwargs.setdefault("backend", backend)
+        kwargs.setdefault("storage_path", storage_path)
+        manager = Mettaton(list(servers), **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        if manager.valid:
+            manager.shutdown(detach=True, deadline=1.0)
@@ -0,0 +1,151 @@
+"""Coalescing of concurrent identical reads"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from mettaton import Mettaton, ContainerBackend
+from mettaton.backends import Coalescer
+
+def run_concurrently(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def test_identical_calls_share_one_request():
+    coalescer = Coalescer()
+    calls = []
+    results = []
+
+    def inspect(ident):
+        calls.append(ident)
+        time.sleep(0.2)
+        return {"Id": ident}
+
+    run_concurrently(10, lambda: results.append(coalescer.call(("inspect", "host", "abc"), inspect, "abc")))
+
+    assert calls == ["abc"]
+    assert results == [{"Id": "abc"}] * 10
+    assert coalescer.stats() == {"requests": 10, "calls": 1, "hits": 9, "coalesced": 1}
+
+def test_different_keys_are_not_shared():
+    coalescer = Coalescer()
+    coalescer.call(("inspect", "host", "abc"), lambda: None)
+    coalescer.call(("inspect", "host", "def"), lambda: None)
+    # Nothing is cached once a call returns
+    coalescer.call(("inspect", "host", "abc"), lambda: None)
+    assert coalescer.stats()["calls"] == 3
+    assert coalescer.stats()["hits"] == 0
+
+def test_errors_are_shared():
+    coalescer = Coalescer()
+    errors = []
+
+    def failing():
+        time.sleep(0.2)
+        raise RuntimeError("daemon gone")
+
+    def call():
+        with pytest.raises(RuntimeError):
+            coalescer.call(("containers", "host"), failing)
+        errors.append(True)
+
+    run_concurrently(3, call)
+    assert len(errors) == 3
+    assert coalescer.stats()["calls"] == 1
+    assert coalescer.in_flight == {}
+
+class FakeAPI:
+    """Low-level client of a daemon answering every call after `delay` seconds"""
+    def __init__(self, delay=0.3):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _answer(self, name, result):
+        with self.lock:
+            self.calls.append(name)
+        time.sleep(self.delay)
+        return result
+
+    def count(self, name):
+        with self.lock:
+            return self.calls.count(name)
+
+    def inspect_container(self, ident):
+        return self._answer("inspect_container", {"State": {"Status": "running"}})
+
+    def containers(self):
+        return self._answer("containers", [])
+
+    def logs(self, ident, **kwargs):
+        if kwargs.get("stream"):
+            return self._answer("logs", iter([b"line\n"]))
+        return self._answer("logs", b"line\n")
+
+    def stop(self, ident, **kwargs):
+        return self._answer("stop", None)
+
+    def remove_container(self, ident):
+        return self._answer("remove_container", None)
+
+class FakeContainers:
+    def __init__(self):
+        self.created = 0
+
+    def create(self, image, **arguments):
+        self.created += 1
+        return SimpleNamespace(id="container-{}".format(self.created), start=lambda: None)
+
+class FakeContainerBackend(ContainerBackend):
+    """Container backend whose daemons are answered by `FakeAPI` clients"""
+    def connect(self, endpoint):
+        client = SimpleNamespace(api=FakeAPI(), containers=FakeContainers(),
+                ping=lambda: True, close=lambda: None)
+        with self.clients_lock:
+            self.clients[endpoint] = client
+
+def test_concurrent_reads_reach_the_daemon_once():
+    backend = FakeContainerBackend()
+    backend.connect("host-1")
+    api = backend.clients["host-1"].api
+
+    run_concurrently(10, lambda: backend.status("host-1", "abc"))
+    run_concurrently(10, lambda: backend.published_ports("host-1"))
+    run_concurrently(10, lambda: backend.logs("host-1", "abc", tail=10))
+
+    assert api.count("inspect_container") == 1
+    assert api.count("containers") == 1
+    assert api.count("logs") == 1
+    assert backend.call_stats() == {"requests": 30, "calls": 3, "hits": 27, "coalesced": 3}
+
+def test_mutating_calls_and_log_streams_are_never_shared():
+    backend = FakeContainerBackend()
+    backend.connect("host-1")
+    api = backend.clients["host-1"].api
+
+    run_concurrently(5, lambda: backend.stop("host-1", "abc", timeout=1))
+    run_concurrently(5, lambda: backend.logs("host-1", "abc", stream=True))
+
+    assert api.count("stop") == 5
+    assert api.count("remove_container") == 5
+    assert api.count("logs") == 5
+    assert backend.call_stats()["requests"] == 0
+
+def test_call_stats_of_the_manager(storage_path):
+    backend = FakeContainerBackend()
+    manager = Mettaton(["host-1"], backend=backend, storage_path=storage_path)
+    try:
+        _, ident = manager.start_server("img", "server")
+        before = manager.get_call_stats()
+        run_concurrently(10, lambda: manager.get_status(ident))
+        after = manager.get_call_stats()
+        # The health checker may have joined in, or led the call
+        assert after["hits"] - before["hits"] >= 9
+        assert after["calls"] - before["calls"] <= 2
+    finally:
+        manager.shutdown(detach=True, deadline=1.0)
@@ -0,0 +1,57 @@
+"""Classification of Docker errors"""
+
+import requests
+from docker.errors import APIError, DockerException
+from requests.exceptions import ConnectionError as RequestsConnectionError, ReadTimeout
+
+from mettaton.errors import *
+from mettaton.utils import produce_appropriate_exception
+
+def api_error(status_code, explanation):
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = "Error"
+    response.url = "http+docker://localhost/v1.43/containers/create"
+    return APIError("{} Error".format(status_code), response, explanation=explanation)
+
+def test_port_collision_carries_the_port():
+    error = produce_appropriate_exception(api_error(500,
+        "driver failed programming external connectivity: Bind for 0.0.0.0:31000 failed: port is already allocated"),
+        host="host-1")
+    assert isinstance(error, DockerNetworkPortAlreadyAllocated)
+    assert error.port == 31000
+    assert error.host == "host-1"
+
+def test_highest_priority_match_wins():
+    # Mentions both the SSL failure and an unreachable daemon
+    error = produce_appropriate_exception(DockerException(
+        "Error while fetching server API version: [SSL: WRONG_VERSION_NUMBER] wrong version number"))
+    assert isinstance(error, DockerConnectSSLWrongVersionNumber)
+
+def test_missing_instances():
+    for explanation in ("No such container: abc", "service abc not found", "task abc not found"):
+        error = produce_appropriate_exception(api_error(404, explanation), instance="abc")
+        assert isinstance(error, NoSuchInstance)
+        assert error.instance == "abc"
+
+def test_404_about_other_objects_is_not_a_missing_instance():
+    error = produce_appropriate_exception(api_error(404, "network foo not found"))
+    assert type(error) is MettatonError
+    assert isinstance(produce_appropriate_exception(api_error(404, "No such image: img:latest")),
+            ImageNotFound)
+
+def test_status_codes():
+    assert isinstance(produce_appropriate_exception(api_error(409,
+        'Conflict. The container name "/server" is already in use by container "abc". '
+        'You have to remove (or rename) that container to be able to reuse that name.')),
+        ContainerNameAlreadyInuse)
+    assert isinstance(produce_appropriate_exception(api_error(409,
+        "removal of container abc is already in progress")), InstanceConflict)
+    assert isinstance(produce_appropriate_exception(api_error(503, "swarm is locked")),
+            DaemonUnavailable)
+    error = produce_appropriate_exception(api_error(500, "something broke"))
+    assert type(error) is DaemonError
+
+def test_transport_errors():
+    assert isinstance(produce_appropriate_exception(ReadTimeout("Read timed out")), DaemonUnavailable)
+    assert isinstance(produce_appropriate_exception(RequestsConnectionError("refused")), DaemonUnavailable)
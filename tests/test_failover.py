@@ -0,0 +1,95 @@
+"""Endpoint liveness and failover"""
+
+from mettaton.persistence import load_state
+from conftest import wait_for, drain_events
+
+def test_instances_of_a_dead_host_are_rescheduled(backend, make_manager):
+    manager = make_manager(suspect_threshold=1, dead_threshold=2)
+    lost = [manager.start_server("img", "lost-{}".format(i), host="host-1",
+            port_config={"80/tcp": 31000 + i})[1] for i in range(3)]
+    kept = manager.start_server("img", "kept", host="host-2")[1]
+    events = manager.subscribe()
+
+    backend.kill("host-1")
+    wait_for(lambda: not "host-1" in manager.get_server_list()
+            and len(manager.get_instance_list()) == 4)
+
+    instances = manager.get_instance_list()
+    assert kept in instances
+    assert not any(ident in instances for ident in lost)
+    records = manager.snapshot()
+    assert {record.name for record in records} == {"kept", "lost-0", "lost-1", "lost-2"}
+    assert {record.host for record in records} == {"host-2"}
+    # Rescheduled with their ports
+    assert {record.ports for record in manager.query(image="img") if record.name != "kept"} == \
+            {((31000 + i, "tcp"),) for i in range(3)}
+
+    states = [state for (_, state) in drain_events(events)]
+    assert states.count("LOST") == 3
+    assert states.count("RESCHEDULED") == 3
+    assert "HOST_DEAD" in states
+
+def test_no_failover_when_disabled(backend, make_manager):
+    manager = make_manager(failover=False, suspect_threshold=1, dead_threshold=2)
+    ident = manager.start_server("img", "server", host="host-1")[1]
+    events = manager.subscribe()
+
+    backend.kill("host-1")
+    seen = []
+    wait_for(lambda: seen.extend(drain_events(events)) or ("host-1", "HOST_DEAD") in seen)
+    assert manager.get_instance_list() == [ident]
+
+def test_unreachable_host_on_restore_is_retried(backend, make_manager):
+    manager = make_manager()
+    ident = manager.start_server("img", "server", host="host-1")[1]
+    manager.shutdown(detach=True, deadline=1.0)
+
+    backend.kill("host-1")
+    restored = make_manager(servers=(), suspect_threshold=1, dead_threshold=50)
+    events = restored.subscribe()
+    assert not "host-1" in restored.get_server_list()
+    assert restored.get_instance_list() == [ident]
+
+    backend.revive("host-1")
+    seen = []
+    wait_for(lambda: seen.extend(drain_events(events)) or ("host-1", "HOST_ALIVE") in seen)
+    assert "host-1" in restored.get_server_list()
+    assert restored.get_instance_list() == [ident]
+    assert not ("host-1", "HOST_DEAD") in seen
+
+def test_unplaced_instances_stay_pending(backend, make_manager, storage_path):
+    # The only other host already publishes the port
+    backend.connect("host-2")
+    backend.spawn("host-2", {"name": "foreign", "port_config": {"80/tcp": 31000}})
+    backend.disconnect("host-2")
+    manager = make_manager(suspect_threshold=1, dead_threshold=2)
+    _, ident = manager.start_server("img", "server", host="host-1", port_config={"80/tcp": 31000})
+    events = manager.subscribe()
+
+    backend.kill("host-1")
+    seen = []
+    wait_for(lambda: seen.extend(drain_events(events)) or (("host-1", ident), "PENDING") in seen)
+    assert manager.get_pending_instances() == [ident]
+    assert manager.get_instance_list() == []
+    wait_for(lambda: load_state(storage_path)["instances"][ident]["host"] is None)
+
+    # A new host makes room for it
+    manager.build_connections(["host-3"])
+    wait_for(lambda: manager.get_pending_instances() == [])
+    record, = manager.query(name="server")
+    assert record.host == "host-3"
+    assert record.ports == ((31000, "tcp"),)
+
+def test_pending_instances_are_restored(backend, make_manager):
+    backend.connect("host-2")
+    backend.spawn("host-2", {"name": "foreign", "port_config": {"80/tcp": 31000}})
+    backend.disconnect("host-2")
+    manager = make_manager(suspect_threshold=1, dead_threshold=2)
+    _, ident = manager.start_server("img", "server", host="host-1", port_config={"80/tcp": 31000})
+    backend.kill("host-1")
+    wait_for(lambda: manager.get_pending_instances() == [ident])
+    manager.shutdown(detach=True, deadline=1.0)
+
+    restored = make_manager(servers=("host-3",))
+    wait_for(lambda: restored.get_pending_instances() == [])
+    assert restored.query(name="server")[0].host == "host-3"
@@ -0,0 +1,43 @@
+"""Fleet queries"""
+
+import time
+
+from mettaton.fleet import Fleet
+from conftest import wait_for
+
+def test_query_by_index(make_manager):
+    manager = make_manager()
+    for i in range(6):
+        manager.start_server("img-{}".format(i % 2), "server-{}".format(i),
+                host="host-{}".format(1 + i % 3 % 2))
+
+    assert len(manager.snapshot()) == 6
+    assert {record.name for record in manager.query(host="host-1")} == \
+            {"server-0", "server-2", "server-3", "server-5"}
+    assert {record.name for record in manager.query(host="host-1", image="img-1")} == \
+            {"server-3", "server-5"}
+    assert manager.query(name="server-4")[0].host == "host-2"
+    assert manager.query(name="missing") == ()
+
+def test_health_follows_the_nurse(make_manager):
+    manager = make_manager()
+    manager.start_server("img", "server")
+    wait_for(lambda: len(manager.query(health="healthy")) == 1)
+
+def test_removed_instances_are_forgotten(make_manager):
+    manager = make_manager()
+    _, ident = manager.start_server("img", "server")
+    manager.shutdown_server(ident)
+    assert manager.snapshot() == ()
+
+def test_age_bounds_and_order():
+    fleet = Fleet()
+    now = time.time()
+    for i, age in enumerate((300, 100, 200)):
+        fleet.add("id-{}".format(i), "host", {"image": "img", "name": "server-{}".format(i),
+            "created": now - age})
+
+    assert [record.ident for record in fleet.snapshot()] == ["id-0", "id-2", "id-1"]
+    assert [record.ident for record in fleet.query(older_than=150)] == ["id-0", "id-2"]
+    assert [record.ident for record in fleet.query(newer_than=250, image="img")] == ["id-2", "id-1"]
+    assert fleet.query(older_than=150, newer_than=250)[0].ident == "id-2"
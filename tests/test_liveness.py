@@ -0,0 +1,42 @@
+"""Endpoint liveness probes"""
+
+import threading
+import time
+
+from mettaton import MemoryBackend
+from conftest import wait_for, drain_events
+
+class HangingBackend(MemoryBackend):
+    """Memory backend whose "hang-" hosts never answer their probes"""
+    def __init__(self):
+        MemoryBackend.__init__(self)
+        self.released = threading.Event()
+
+    def ping(self, endpoint):
+        if endpoint.startswith("hang-"):
+            self.released.wait()
+        return MemoryBackend.ping(self, endpoint)
+
+def test_hung_probes_do_not_delay_live_hosts(make_manager):
+    backend = HangingBackend()
+    hanging = ["hang-{}".format(i) for i in range(5)]
+    try:
+        manager = make_manager(servers=hanging + ["live"], backend=backend,
+                suspect_threshold=2, dead_threshold=1000)
+        events = manager.subscribe()
+        started = time.time()
+
+        suspects = set()
+        def all_suspect():
+            suspects.update(endpoint for (endpoint, state) in drain_events(events)
+                    if state == "HOST_SUSPECT")
+            return suspects >= set(hanging)
+        # Two cycles of one probe timeout each, not one timeout per hanging host
+        wait_for(all_suspect, timeout=8.0)
+        assert time.time() - started < 8.0
+        assert not "live" in suspects
+
+        host, _ = manager.start_server("img", "server")
+        assert host == "live"
+    finally:
+        backend.released.set()
@@ -0,0 +1,67 @@
+"""State persistence and migration"""
+
+import json
+import threading
+
+import pytest
+
+from mettaton.errors import DockerNetworkPortAlreadyAllocated
+from mettaton.persistence import load_state, save_state, STATE_VERSION
+
+def test_round_trip(storage_path):
+    record = {"host": "host-1", "image": "img", "name": "server", "environment": {"A": "1"},
+            "port_config": {"80/tcp": 31000}, "created": 1700000000.0}
+    save_state(storage_path, ["host-1"], {"abc": record})
+
+    state = load_state(storage_path)
+    assert state["version"] == STATE_VERSION
+    assert state["servers"] == ["host-1"]
+    assert state["instances"] == {"abc": record}
+
+def test_legacy_state_is_migrated(storage_path):
+    with open(storage_path, "w") as fptr:
+        json.dump({
+            "servers": ["host-1"],
+            "instances": {"abc": "host-1", "def": "host-1"},
+            "specs": {"abc": {"image": "img", "name": "server", "environment": {},
+                "port_config": {}}}
+        }, fptr, indent=4)
+
+    state = load_state(storage_path)
+    assert state["version"] == STATE_VERSION
+    assert state["instances"]["abc"]["image"] == "img"
+    assert state["instances"]["abc"]["host"] == "host-1"
+    # Unknown specifications are kept, empty
+    assert state["instances"]["def"]["image"] is None
+
+def test_instances_are_restored(make_manager, storage_path):
+    manager = make_manager()
+    host, ident = manager.start_server("img", "server", environment={"A": "1"},
+            port_config={"80/tcp": 31000})
+    manager.shutdown(detach=True, deadline=1.0)
+
+    restored = make_manager(servers=())
+    assert restored.get_instance_list() == [ident]
+    record, = restored.query(name="server")
+    assert (record.ident, record.host, record.ports) == (ident, host, ((31000, "tcp"),))
+    # Its port is still taken
+    with pytest.raises(DockerNetworkPortAlreadyAllocated):
+        restored.start_server("img", "other", host=host, port_config={"80/tcp": 31000})
+    # And its specification kept for the next restore
+    restored.save_state()
+    assert load_state(storage_path)["instances"][ident]["environment"] == {"A": "1"}
+
+def test_concurrent_saves_keep_every_instance(make_manager, storage_path):
+    manager = make_manager()
+
+    def spawn(worker):
+        for i in range(20):
+            manager.start_server("img", "server-{}-{}".format(worker, i))
+
+    threads = [threading.Thread(target=spawn, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(load_state(storage_path)["instances"]) == 80
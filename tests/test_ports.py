@@ -0,0 +1,74 @@
+"""Host port index"""
+
+import pytest
+
+from mettaton.core import AUTO_PORT
+from mettaton.errors import DockerNetworkPortAlreadyAllocated
+
+def port_of(manager, name):
+    """Return the host port published by the instance called `name`"""
+    (port, _), = manager.query(name=name)[0].ports
+    return port
+
+def test_collision_is_rejected_before_spawning(make_manager):
+    manager = make_manager()
+    manager.start_server("img", "first", host="host-1", port_config={"80/tcp": 31000})
+
+    with pytest.raises(DockerNetworkPortAlreadyAllocated) as error:
+        manager.start_server("img", "second", host="host-1", port_config={"80/tcp": 31000})
+    assert error.value.port == 31000
+    # A different protocol is a different port
+    manager.start_server("img", "third", host="host-1", port_config={"80/udp": 31000})
+
+def test_random_placement_avoids_busy_hosts(make_manager):
+    manager = make_manager()
+    manager.start_server("img", "first", host="host-1", port_config={"80/tcp": 31000})
+
+    host, _ = manager.start_server("img", "second", port_config={"80/tcp": 31000})
+    assert host == "host-2"
+
+    with pytest.raises(DockerNetworkPortAlreadyAllocated):
+        manager.start_server("img", "third", port_config={"80/tcp": 31000})
+
+def test_foreign_ports_are_indexed(backend, make_manager):
+    backend.connect("host-1")
+    backend.spawn("host-1", {"name": "foreign", "port_config": {"80/tcp": 31000}})
+    backend.disconnect("host-1")
+    manager = make_manager(servers=("host-1",))
+    spawns = []
+    spawn = backend.spawn
+    backend.spawn = lambda *args, **kwargs: spawns.append(args) or spawn(*args, **kwargs)
+
+    with pytest.raises(DockerNetworkPortAlreadyAllocated):
+        manager.start_server("img", "server", port_config={"80/tcp": 31000})
+    # Rejected from the index, the daemon was never asked
+    assert spawns == []
+
+def test_auto_ports(make_manager):
+    manager = make_manager(servers=("host-1",), port_range=(31000, 31002))
+    ports = []
+    for i in range(3):
+        manager.start_server("img", "server-{}".format(i), port_config={"80/tcp": AUTO_PORT})
+        ports.append(port_of(manager, "server-{}".format(i)))
+    assert sorted(ports) == [31000, 31001, 31002]
+
+    with pytest.raises(DockerNetworkPortAlreadyAllocated):
+        manager.start_server("img", "server-3", port_config={"80/tcp": AUTO_PORT})
+
+    manager.shutdown_server(manager.query(name="server-2")[0].ident)
+    manager.start_server("img", "server-4", port_config={"80/tcp": AUTO_PORT})
+    assert port_of(manager, "server-4") == ports[-1]
+
+def test_failed_spawn_releases_its_ports(backend, make_manager):
+    manager = make_manager(servers=("host-1",))
+    spawn = backend.spawn
+
+    def failing_spawn(endpoint, spec, **options):
+        raise OSError("Read timed out")
+
+    backend.spawn = failing_spawn
+    with pytest.raises(OSError):
+        manager.start_server("img", "server", port_config={"80/tcp": 31000})
+    backend.spawn = spawn
+
+    manager.start_server("img", "server", port_config={"80/tcp": 31000})
@@ -0,0 +1,53 @@
+"""Idle instances reaping"""
+
+import time
+
+from mettaton.persistence import load_state
+from conftest import wait_for, drain_events
+
+POLICY = {"timeout": 0.5, "interval": 0.2, "batch_size": 2}
+
+def test_idle_instances_are_reaped(backend, make_manager):
+    manager = make_manager(idle_policy=POLICY)
+    busy = manager.start_server("img", "busy", host="host-1")[1]
+    idle = [manager.start_server("img", "idle-{}".format(i))[1] for i in range(3)]
+    events = manager.subscribe()
+
+    end = time.time() + 2
+    while time.time() < end:
+        backend.traffic("host-1", busy, network=100000)
+        time.sleep(0.1)
+
+    wait_for(lambda: manager.get_instance_list() == [busy])
+    reaped = [watch[1] for (watch, state) in drain_events(events) if state == "REAPED"]
+    assert sorted(reaped) == sorted(idle)
+    assert [record.ident for record in manager.snapshot()] == [busy]
+
+def test_log_lines_count_as_activity(backend, make_manager):
+    manager = make_manager(idle_policy=POLICY)
+    ident = manager.start_server("img", "chatty", host="host-1")[1]
+
+    end = time.time() + 1.5
+    while time.time() < end:
+        backend.traffic("host-1", ident, log_lines=1)
+        time.sleep(0.1)
+    assert manager.get_instance_list() == [ident]
+
+def test_idle_instances_are_checkpointed(backend, make_manager):
+    manager = make_manager(idle_policy={**POLICY, "checkpoint": "saves"})
+    manager.start_server("img", "idle")
+
+    wait_for(lambda: manager.get_instance_list() == [])
+    assert list(backend.images.values()) == [("saves", "idle")]
+
+def test_reap_instances_in_one_batch(make_manager, storage_path):
+    manager = make_manager()
+    instances = [manager.start_server("img", "server-{}".format(i)) for i in range(4)]
+    events = manager.subscribe()
+
+    assert sorted(manager.reap_instances(instances)) == sorted(instances)
+    assert manager.get_instance_list() == []
+    assert load_state(storage_path)["instances"] == {}
+    # No longer watched, the nurse never reports them missing
+    time.sleep(2.5)
+    assert not any(state == "NOT_FOUND" for (_, state) in drain_events(events))
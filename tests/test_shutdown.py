@@ -0,0 +1,110 @@
+"""Draining and shutting down"""
+
+import gc
+import os
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from mettaton import Mettaton, MemoryBackend, ContainerBackend
+from mettaton.persistence import load_state
+from conftest import wait_for
+
+class SlowStopBackend(MemoryBackend):
+    """Memory backend taking `delay` seconds to answer the stops of `slow` instances"""
+    def __init__(self, delay):
+        MemoryBackend.__init__(self)
+        self.delay = delay
+        self.slow = set()
+        self.timeouts = {}
+
+    def stop(self, endpoint, ident, timeout=None):
+        self.timeouts[ident] = timeout
+        MemoryBackend.stop(self, endpoint, ident, timeout)
+        if ident in self.slow:
+            time.sleep(self.delay)
+
+def saved_instances(storage_path):
+    return set(load_state(storage_path)["instances"])
+
+def test_drain_removes_every_instance(make_manager, storage_path):
+    backend = MemoryBackend(latency=0.1)
+    manager = make_manager(backend=backend)
+    for i in range(10):
+        manager.start_server("img", "server-{}".format(i))
+    started = time.time()
+    assert manager.drain(workers=10) == []
+    # In parallel, not one stop after the other
+    assert time.time() - started < 1.0
+    assert manager.get_instance_list() == []
+    assert saved_instances(storage_path) == set()
+    assert all(len(instances) == 0 for instances in backend.hosts.values())
+
+def test_drain_deadline_bounds_the_stops(make_manager, storage_path):
+    backend = SlowStopBackend(delay=1.5)
+    manager = make_manager(backend=backend)
+    slow = manager.start_server("img", "slow")[1]
+    manager.start_server("img", "fast")
+    backend.slow.add(slow)
+
+    started = time.time()
+    assert manager.drain(grace_period=5, deadline=0.3) == [slow]
+    assert time.time() - started < 1.0
+    # Nobody was given more time than the deadline left
+    assert all(timeout <= 0.3 for timeout in backend.timeouts.values())
+    assert saved_instances(storage_path) == {slow}
+
+    # The abandoned stop records its outcome once it completes
+    wait_for(lambda: saved_instances(storage_path) == set())
+    assert manager.get_instance_list() == []
+
+def test_abandoned_stops_do_not_hold_the_process(tmp_path):
+    script = """
+import threading
+from mettaton import Mettaton, MemoryBackend
+
+class HangingBackend(MemoryBackend):
+    def stop(self, endpoint, ident, timeout=None):
+        threading.Event().wait()
+
+manager = Mettaton(["host-1"], backend=HangingBackend(), storage_path={!r})
+manager.start_server("img", "server")
+manager.shutdown(deadline=0.5)
+""".format(str(tmp_path / "mettaton.state"))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started = time.time()
+    subprocess.run([sys.executable, "-c", script], cwd=root, check=True, timeout=20)
+    assert time.time() - started < 5.0
+
+def test_detached_instances_keep_running(backend, make_manager):
+    manager = make_manager()
+    idents = [manager.start_server("img", "server-{}".format(i))[1] for i in range(3)]
+    manager.shutdown(detach=True, deadline=1.0)
+    assert not manager.valid
+    assert sorted(ident for instances in backend.hosts.values() for ident in instances) == sorted(idents)
+
+    restored = make_manager()
+    assert sorted(restored.get_instance_list()) == sorted(idents)
+
+def test_dropped_manager_detaches(backend, storage_path):
+    threads = set(threading.enumerate())
+    manager = Mettaton(["host-1"], backend=backend, storage_path=storage_path)
+    ident = manager.start_server("img", "server")[1]
+    del manager
+    gc.collect()
+    assert ident in backend.hosts["host-1"]
+    assert saved_instances(storage_path) == {ident}
+    # Nothing is left to hold the process open
+    wait_for(lambda: all(thread.daemon for thread in set(threading.enumerate()) - threads))
+
+def test_grace_periods_are_rounded_up():
+    calls = []
+    api = SimpleNamespace(stop=lambda ident, **kwargs: calls.append(kwargs),
+            remove_container=lambda ident: None)
+    backend = ContainerBackend()
+    backend.clients["host-1"] = SimpleNamespace(api=api)
+    backend.stop("host-1", "abc", timeout=0.5)
+    backend.stop("host-1", "abc")
+    assert calls == [{"timeout": 1}, {}]
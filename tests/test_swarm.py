@@ -0,0 +1,81 @@
+"""Port allocation of MettatonSwarm"""
+
+import pytest
+
+from mettaton import MettatonSwarm, MemoryBackend
+from mettaton.errors import DockerNetworkPortAlreadyAllocated, ImageNotFound
+from mettaton.persistence import load_state
+from conftest import wait_for, drain_events
+
+class MemorySwarmBackend(MemoryBackend):
+    """Memory backend standing for a swarm manager, without any swarm to drive"""
+    missing_image = None
+    broken_image = None
+
+    def client(self, endpoint):
+        return None
+
+    def spawn(self, endpoint, spec, **options):
+        if spec["image"] == self.missing_image:
+            raise ImageNotFound("No such image: {}".format(spec["image"]), host=endpoint)
+        if spec["image"] == self.broken_image:
+            raise OSError("Connection reset by peer")
+        return MemoryBackend.spawn(self, endpoint, spec, **options)
+
+@pytest.fixture
+def swarm(storage_path):
+    manager = MettatonSwarm(nfp=5000, storage_path=storage_path, backend=MemorySwarmBackend())
+    manager.connect()
+    yield manager
+    manager.drain()
+    manager._stop_nurse(timeout=1.0)
+
+def launch(swarm, **kwargs):
+    return swarm.launch_server("img", **kwargs)
+
+def test_automatic_ports_follow_each_other(swarm):
+    assert [launch(swarm)[1] for _ in range(3)] == [5001, 5002, 5003]
+
+def test_released_ports_are_reused(swarm):
+    launched = [launch(swarm) for _ in range(4)]
+    swarm.stop_server(launched[1][0])
+    swarm.stop_server(launched[3][0])
+    assert launch(swarm)[1] == 5002
+    assert launch(swarm)[1] == 5004
+    assert launch(swarm)[1] == 5005
+
+def test_explicit_ports_leave_gaps(swarm):
+    assert launch(swarm, port=5004)[1] == 5004
+    assert [launch(swarm)[1] for _ in range(4)] == [5001, 5002, 5003, 5005]
+
+def test_explicit_ports_below_the_range_are_never_handed_out(swarm):
+    identifier, port = launch(swarm, port=80)
+    assert port == 80
+    swarm.stop_server(identifier)
+    assert launch(swarm)[1] == 5001
+
+def test_failed_launch_does_not_release_ports_in_use(swarm):
+    launch(swarm)
+    results = swarm.launch_servers([{"image": "img", "port": 5001}])
+    assert isinstance(results[0], DockerNetworkPortAlreadyAllocated)
+    assert [launch(swarm)[1] for _ in range(2)] == [5002, 5003]
+
+def test_failed_launch_releases_its_own_port(swarm):
+    swarm.backend.missing_image = "missing"
+    results = swarm.launch_servers([{"image": "missing"}, {"image": "missing", "port": 5003}])
+    assert all(isinstance(result, ImageNotFound) for result in results)
+    assert [launch(swarm)[1] for _ in range(3)] == [5001, 5002, 5003]
+
+def test_unexpected_errors_do_not_abort_the_batch(swarm, storage_path):
+    swarm.backend.broken_image = "broken"
+    events = swarm.subscribe()
+    results = swarm.launch_servers([{"image": "broken"}, {"image": "img"}])
+    assert isinstance(results[0], OSError)
+    identifier, port = results[1]
+    assert port == 5002
+    assert list(load_state(storage_path)["instances"]) == [identifier]
+    # The launched server is watched
+    seen = []
+    wait_for(lambda: seen.extend(drain_events(events))
+            or any(watch[1] == identifier for (watch, _) in seen))
+    assert launch(swarm)[1] == 5001